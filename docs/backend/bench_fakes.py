@@ -0,0 +1,240 @@
+"""Local stand-ins for the benchmark harness: a fake upstream server and a stub Llama.
+
+FakeUpstream serves the MEDICAL_KNOWLEDGE_HUB APIs, MedlinePlus search/article
+pages and the dictionary API from one local HTTP server with configurable
+latency and failure rates. StubLlama mimics the parts of llama_cpp.Llama that
+main.py uses and spends time like a CPU model: per prompt token evaluated
+(honouring prefix reuse) and per token decoded. use_fakes wires both into an
+imported main; offline_app does the same inside uvicorn worker processes.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+SNIPPETS = [
+    "Rate control with beta blockers or diltiazem is first-line in stable atrial fibrillation.",
+    "Indicated for the treatment of hypertension, to lower blood pressure and reduce cardiovascular risk.",
+    "Chest pain evaluation includes ECG within 10 minutes and serial troponin measurement.",
+    "Community acquired pneumonia is treated empirically based on severity and risk factors.",
+    "Warfarin therapy requires INR monitoring with a therapeutic range of 2.0 to 3.0.",
+]
+
+ARTICLE_HTML = """<!DOCTYPE html><html><head><title>{title} | MedlinePlus</title>
+<script>var analytics = {{}};</script><style>body {{ font-family: sans-serif; }}</style></head>
+<body><header><nav>{nav}</nav></header>
+<div id="main-content"><h1>{title}</h1>{paragraphs}<footer>Page last updated</footer></div>
+<aside>{nav}</aside><footer>U.S. National Library of Medicine</footer></body></html>"""
+
+SEARCH_HTML = """<!DOCTYPE html><html><body><div class="results">
+<a class="results-link" href="/article/{slug}.html">{title}</a>
+<p>{blurb}</p></div></body></html>"""
+
+
+def article_page(title):
+    paragraphs = "".join(f"<p>{SNIPPETS[i % len(SNIPPETS)]} {title} is discussed here.</p>" for i in range(40))
+    nav = "".join(f'<a href="/topic{i}.html">Health topic {i}</a>' for i in range(150))
+    return ARTICLE_HTML.format(title=title, paragraphs=paragraphs, nav=nav)
+
+
+class FakeUpstream:
+    """Threaded HTTP server answering every upstream the backend calls.
+
+    latency/jitter are seconds; failure_rate returns 500s and rate_limit_rate
+    returns 429s. Request counts per route are kept in `counts`.
+    """
+
+    def __init__(self, latency=0.1, jitter=0.05, failure_rate=0.0, rate_limit_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def urls(self):
+        """Values for main.MEDICAL_KNOWLEDGE_HUB, MEDLINEPLUS_SITE and DICTIONARY_API"""
+        base = self.base_url
+        return {
+            "hub": {
+                "guidelines": f"{base}/clinicaltrials/study_fields?expr=",
+                "drugs": f"{base}/fda/label.json?search=",
+                "research": f"{base}/pubmed/esearch.fcgi?db=pubmed&term=",
+                "general": f"{base}/medlineplus-api/page?query="
+            },
+            "medlineplus": f"{base}/medlineplus",
+            "dictionary": f"{base}/dictionary/"
+        }
+
+    def respond(self, path, query):
+        """(status, content_type, body) for a request"""
+        topic = unquote(query.split("=", 1)[-1]) if query else path.rsplit("/", 1)[-1]
+        snippet = SNIPPETS[zlib.crc32(topic.encode()) % len(SNIPPETS)]
+        if path.startswith("/clinicaltrials"):
+            body = {"StudyFieldsResponse": {"StudyFields": [{"BriefTitle": [f"Trial of {topic}: {snippet}"]}]}}
+        elif path.startswith("/fda"):
+            body = {"results": [{"indications_and_usage": [snippet]}]}
+        elif path.startswith("/pubmed"):
+            body = {"esearchresult": {"idlist": [str(30000000 + zlib.crc32(topic.encode()) % 1000000)]}}
+        elif path.startswith("/medlineplus-api"):
+            body = {"results": [{"body": [{"text": snippet}]}]}
+        elif path.startswith("/medlineplus/search"):
+            slug = re.sub(r"[^a-z0-9]+", "-", topic.lower()).strip("-") or "topic"
+            return 200, "text/html", SEARCH_HTML.format(slug=slug, title=topic.title(), blurb=snippet)
+        elif path.startswith("/medlineplus/article"):
+            title = path.rsplit("/", 1)[-1].replace(".html", "").replace("-", " ").title()
+            return 200, "text/html", article_page(title)
+        elif path.startswith("/dictionary"):
+            body = [{"meanings": [{"definitions": [{"definition": f"{topic}: {snippet}"}]}]}]
+        else:
+            return 404, "application/json", "{}"
+        return 200, "application/json", json.dumps(body)
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                route = "/" + parsed.path.strip("/").split("/")[0]
+                with upstream.lock:
+                    upstream.counts[route] = upstream.counts.get(route, 0) + 1
+                    delay = max(0.0, upstream.random.gauss(upstream.latency, upstream.jitter))
+                    roll = upstream.random.random()
+                time.sleep(delay)
+                if roll < upstream.failure_rate:
+                    status, ctype, body = 500, "text/plain", "upstream error"
+                elif roll < upstream.failure_rate + upstream.rate_limit_rate:
+                    status, ctype, body = 429, "text/plain", "rate limited"
+                else:
+                    status, ctype, body = upstream.respond(parsed.path, parsed.query)
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+REPLY_TEXT = (
+    "**Summary**: Start rate control and assess stroke risk. "
+    "**Recommendations**: 1. Obtain ECG and basic labs. 2. Beta blocker or diltiazem for rate control. "
+    "3. Calculate CHA2DS2-VASc and start anticoagulation when indicated. "
+    "**Monitoring**: Heart rate, blood pressure, signs of bleeding, renal function. "
+) * 4
+
+
+class StubLlama:
+    """Drop-in for llama_cpp.Llama that sleeps instead of computing.
+
+    Set the class attributes (bench_load.py does this from its flags) to control speed.
+    """
+    prompt_tokens_per_sec = 400.0
+    tokens_per_sec = 20.0
+
+    def __init__(self, model_path=None, n_ctx=1024, **kwargs):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.input_ids = []
+        self.n_tokens = 0
+
+    def tokenize(self, text, add_bos=True, special=False):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="ignore")
+        ids = [zlib.crc32(piece.encode()) % 32000 + 2 for piece in re.findall(r"\w+|[^\w\s]|\s+", text)]
+        return ([1] if add_bos else []) + ids
+
+    def detokenize(self, tokens):
+        return b""
+
+    def reset(self):
+        self.input_ids = []
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        time.sleep(len(tokens) / self.prompt_tokens_per_sec)
+        self.input_ids = self.input_ids[:self.n_tokens] + list(tokens)
+        self.n_tokens = len(self.input_ids)
+
+    def save_state(self):
+        return list(self.input_ids[:self.n_tokens])
+
+    def load_state(self, state):
+        self.input_ids = list(state)
+        self.n_tokens = len(self.input_ids)
+
+    def _prefill(self, prompt):
+        tokens = self.tokenize(prompt.encode("utf-8"))
+        common = 0
+        for a, b in zip(self.input_ids[:self.n_tokens], tokens[:-1]):
+            if a != b:
+                break
+            common += 1
+        self.n_tokens = common
+        self.eval(tokens[common:])
+
+    def _pieces(self, max_tokens):
+        words = re.findall(r"\s*\S+", REPLY_TEXT)  # Each piece keeps its leading space
+        for i, word in enumerate(words[:max_tokens or 16]):
+            word = " " + word if i == 0 else word  # SentencePiece models open with a space-prefixed token
+            time.sleep(1.0 / self.tokens_per_sec)
+            self.input_ids = self.input_ids[:self.n_tokens] + self.tokenize(word, add_bos=False)
+            self.n_tokens = len(self.input_ids)
+            yield word
+
+    def __call__(self, prompt, stream=False, max_tokens=16, **kwargs):
+        self._prefill(prompt)
+        if stream:
+            return ({"choices": [{"text": piece, "finish_reason": None}]} for piece in self._pieces(max_tokens))
+        text = "".join(self._pieces(max_tokens))
+        return {"choices": [{"text": text, "finish_reason": "length"}]}
+
+
+def use_fakes(main, urls, redis=False):
+    """Point an imported main at StubLlama and the FakeUpstream urls()"""
+    main.Llama = StubLlama
+    main.MEDICAL_KNOWLEDGE_HUB.update(urls["hub"])
+    main.MEDLINEPLUS_SITE = urls["medlineplus"]
+    main.DICTIONARY_API = urls["dictionary"]
+    if not redis:
+        def redis_disabled():
+            raise RuntimeError("disabled for benchmark")
+        main.COMPONENT_LOADERS["redis"] = redis_disabled
+
+
+def offline_app():
+    """uvicorn factory (bench_fakes:offline_app --factory) for multi-process benchmarks.
+
+    The parent starts the FakeUpstream and passes its urls() in BENCH_UPSTREAM_URLS;
+    BENCH_TOKENS_PER_SEC and BENCH_PROMPT_TOKENS_PER_SEC set the stub's speed.
+    """
+    StubLlama.tokens_per_sec = float(os.getenv("BENCH_TOKENS_PER_SEC", StubLlama.tokens_per_sec))
+    StubLlama.prompt_tokens_per_sec = float(os.getenv("BENCH_PROMPT_TOKENS_PER_SEC", StubLlama.prompt_tokens_per_sec))
+    import main
+    use_fakes(main, json.loads(os.environ["BENCH_UPSTREAM_URLS"]))
+    return main.app
@@ -0,0 +1,191 @@
+"""Offline load benchmark for the chat backend.
+
+Runs the real app in-process with every upstream API replaced by a local fake
+server and the GGUF model replaced by StubLlama (see bench_fakes.py), drives
+/chat at a target concurrency and reports p50/p95/p99 latency per stage plus
+throughput. Results can be saved and compared against a baseline to catch
+regressions before deploy.
+
+Run from docs/backend:
+    python bench_load.py --concurrency 8 --requests 200 --upstream-latency 0.2 --failure-rate 0.05
+    python bench_load.py --save baseline.json
+    python bench_load.py --compare baseline.json --tolerance 0.2   # exit 1 on p95 regression
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+
+from bench_fakes import FakeUpstream, StubLlama, use_fakes
+
+QUESTIONS = [
+    "What is the first-line management of atrial fibrillation with rapid ventricular response?",
+    "How should I monitor a patient started on warfarin?",
+    "Explain the workup for new onset chest pain in the emergency department",
+    "What are the treatment options for community acquired pneumonia?",
+    "How do you manage hypertensive urgency?",
+    "What are the side effects of sertraline?",
+    "Initial management of diabetic ketoacidosis",
+    "When is a CT pulmonary angiogram indicated for suspected PE?",
+]
+
+
+def question(i, unique=False):
+    """The i-th benchmark question; unique ones defeat the response cache and generation coalescing"""
+    message = QUESTIONS[i % len(QUESTIONS)]
+    return f"{message} (case {i})" if unique else message
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def start_app(args):
+    """Import main with fakes patched in and serve it on a local port"""
+    upstream = FakeUpstream(args.upstream_latency, args.upstream_jitter, args.failure_rate, args.rate_limit_rate).start()
+
+    model_file = tempfile.NamedTemporaryFile(suffix=".gguf", delete=False)
+    model_file.close()
+    os.environ.update({
+        "MODEL_PATH": model_file.name,
+        "LLM_WORKERS": str(args.llm_workers),
+        "LLM_QUEUE_DEPTH": str(args.queue_depth),
+    })
+    StubLlama.tokens_per_sec = args.tokens_per_sec
+    StubLlama.prompt_tokens_per_sec = args.prompt_tokens_per_sec
+
+    import main
+    logging.getLogger("SAWA-MEDICAL").setLevel(logging.WARNING)
+    use_fakes(main, upstream.urls(), args.redis)
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 300
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/ready", timeout=2).status_code == 200:
+                return main, upstream, server, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("backend never became ready")
+
+
+def run_load(base_url, args):
+    def one(i):
+        message = question(i, args.unique)
+        start = time.monotonic()
+        try:
+            resp = requests.post(f"{base_url}{args.endpoint}", json={"message": message, "history": []}, timeout=300)
+            body = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
+            status = resp.status_code if "error" not in body else "error"
+        except requests.RequestException:
+            status, body = "exception", {}
+        return status, time.monotonic() - start, body.get("timings", {})
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    return results, time.monotonic() - start
+
+
+def summarize(results, elapsed):
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [r for r in results if r[0] == 200]
+    stages = {"end_to_end": [latency * 1000 for _, latency, _ in ok]}
+    for _, _, timings in ok:
+        for name, value in timings.items():
+            stages.setdefault(name[:-3] if name.endswith("_ms") else name, []).append(value)
+    return {
+        "requests": len(results),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "statuses": statuses,
+        "stages_ms": {
+            name: {"n": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99)}
+            for name, values in stages.items()
+        }
+    }
+
+
+def print_report(summary, upstream_counts):
+    print(f"requests={summary['requests']} elapsed={summary['elapsed_s']}s "
+          f"throughput={summary['throughput_rps']} req/s statuses={summary['statuses']}")
+    print(f"upstream calls: {upstream_counts}")
+    print(f"{'stage':<22}{'n':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for name, row in sorted(summary["stages_ms"].items(), key=lambda item: -item[1]["p50"]):
+        print(f"{name:<22}{row['n']:>6}{row['p50']:>11.1f}{row['p95']:>11.1f}{row['p99']:>11.1f}")
+
+
+def compare(summary, baseline, tolerance):
+    """Names of stages whose p95 grew by more than `tolerance` over the baseline"""
+    regressions = []
+    for name, row in baseline["stages_ms"].items():
+        current = summary["stages_ms"].get(name)
+        if current and row["p95"] > 1.0 and current["p95"] > row["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {row['p95']:.1f} -> {current['p95']:.1f} ms")
+    if summary["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['throughput_rps']} -> {summary['throughput_rps']} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load benchmark with fake upstreams and a stub LLM")
+    parser.add_argument("--endpoint", default="/chat")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--unique", action="store_true", help="Make every question unique to defeat the response cache")
+    parser.add_argument("--upstream-latency", type=float, default=0.15, help="Mean upstream latency (s)")
+    parser.add_argument("--upstream-jitter", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of upstream calls answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of upstream calls answered with 429")
+    parser.add_argument("--tokens-per-sec", type=float, default=20.0, help="Stub LLM decode speed")
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=400.0, help="Stub LLM prompt eval speed")
+    parser.add_argument("--llm-workers", type=int, default=1)
+    parser.add_argument("--queue-depth", type=int, default=64)
+    parser.add_argument("--redis", action="store_true", help="Use a local Redis if one is running")
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--save", help="Write the summary JSON here")
+    parser.add_argument("--compare", help="Baseline summary JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    main_module, upstream, server, base_url = start_app(args)
+    try:
+        results, elapsed = run_load(base_url, args)
+    finally:
+        server.should_exit = True
+        upstream.stop()
+
+    summary = summarize(results, elapsed)
+    print_report(summary, upstream.counts)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Micro-benchmark: safe_content per-call cost before/after the precompiled matcher.
+
+Run from docs/backend:  python bench_safe_content.py
+"""
+import re
+import timeit
+
+import main
+
+# Text in the shape of a MedlinePlus #main-content block after get_text()
+MEDLINEPLUS_TEXT = (
+    "Atrial Fibrillation Also called: AF, AFib, Auricular fibrillation "
+    "On this page Basics Summary Start Here Diagnosis and Tests Prevention and Risk Factors "
+    "Treatments and Therapies Learn More Living With Related Issues Specifics Genetics "
+    "See, Play and Learn Images Research Clinical Trials Journal Articles Resources "
+    "Reference Desk Find an Expert For You Children Teenagers Women Patient Handouts "
+    "Summary What is atrial fibrillation (AFib)? Atrial fibrillation (AFib) is the most "
+    "common type of arrhythmia. An arrhythmia is a problem with the rate or rhythm of your "
+    "heartbeat. It means that your heart beats too quickly, too slowly, or with an "
+    "irregular pattern. AFib happens when the electrical signals in the upper chambers of "
+    "your heart (the atria) fire in a disorganized way. This causes the atria to quiver "
+    "instead of contracting normally. Blood may pool in the atria and form clots. If a clot "
+    "breaks free and travels to the brain, it can cause a stroke. What causes AFib? "
+    "Sometimes the cause of AFib is unknown. But it is often caused by damage to the heart's "
+    "electrical system from other conditions, such as high blood pressure, coronary artery "
+    "disease, heart valve disease, hyperthyroidism, obesity, diabetes, chronic kidney "
+    "disease, lung disease, and sleep apnea. Who is more likely to develop AFib? Your risk "
+    "goes up with age, and people who drink a lot of alcohol or who have a family history "
+    "of AFib are also at higher risk. What are the symptoms of AFib? Some people with AFib "
+    "don't have any symptoms. Others may have fatigue, palpitations, shortness of breath, "
+    "dizziness, or chest pain. How is AFib diagnosed? To find out if you have AFib, your "
+    "health care provider will ask about your medical history, do a physical exam, and "
+    "may order an electrocardiogram (EKG), a Holter or event monitor, an echocardiogram, "
+    "a stress test, or blood tests. What are the treatments for AFib? Treatments include "
+    "medicines to slow the heart rate, medicines or electrical cardioversion to restore a "
+    "normal rhythm, blood thinners to prevent clots, and procedures such as catheter "
+    "ablation. NIH: National Heart, Lung, and Blood Institute "
+) * 2
+
+
+def legacy_safe_content(text, max_len=120):
+    """safe_content as it was before the precompiled matcher (pattern rebuilt, text scanned twice)"""
+    if not text or not isinstance(text, str):
+        return ""
+    clean = re.sub(r'[^\x20-\x7E]', '', text)
+    clean = re.sub(r'\s+', ' ', clean).strip()
+    clinical_terms = '|'.join(list(main.MEDICAL_SHORTHAND.values()) + list(main.MEDICAL_ACRONYMS.values()))
+    if re.search(clinical_terms, clean, re.IGNORECASE):
+        matches = list(re.finditer(clinical_terms, clean, re.IGNORECASE))
+        if matches:
+            start_idx = max(0, matches[0].start() - 20)
+            end_idx = min(len(clean), matches[0].end() + 20)
+            clean = clean[start_idx:end_idx]
+    if len(clean) > max_len:
+        return clean[:max_len] + '...'
+    return clean
+
+
+def per_call_us(func, text, number=2000, repeat=5):
+    best = min(timeit.repeat(lambda: func(text), number=number, repeat=repeat))
+    return best / number * 1e6
+
+
+if __name__ == "__main__":
+    samples = {
+        "medlineplus page": MEDLINEPLUS_TEXT,
+        "no clinical term": "Find an expert near you. " * 80,
+        "short snippet": "Indicated for the treatment of hypertension, to lower blood pressure.",
+    }
+    print(f"{'sample':<18}{'chars':>7}{'before (us)':>14}{'after (us)':>13}{'speedup':>9}")
+    for name, text in samples.items():
+        before = per_call_us(legacy_safe_content, text)
+        after = per_call_us(main.safe_content, text)
+        print(f"{name:<18}{len(text):>7}{before:>14.1f}{after:>13.1f}{before / after:>8.1f}x")
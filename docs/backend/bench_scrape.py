@@ -0,0 +1,99 @@
+"""Benchmark: MedlinePlus extraction with BeautifulSoup (before) vs the streaming parsers (after).
+
+Uses the saved pages in fixtures/ (MedlinePlus search and article page
+layout) and reports parse time, peak traced memory and bytes read per page.
+The legacy path needs beautifulsoup4, which the backend no longer requires.
+
+Run from docs/backend:  python bench_scrape.py [--repeat 50]
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+import main
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def chunked(data, size=main.SCRAPE_CHUNK_BYTES):
+    """Yield the page the way requests' iter_content would, counting what was consumed"""
+    chunked.consumed = 0
+    for i in range(0, len(data), size):
+        chunked.consumed += len(data[i:i + size])
+        yield data[i:i + size]
+
+
+def legacy_search(data):
+    from bs4 import BeautifulSoup
+    text = data.decode("utf-8")
+    if "No results found" in text:
+        return None
+    link = BeautifulSoup(text, "html.parser").find("a", class_="results-link")
+    return link.get("href") if link else None
+
+
+def legacy_article(data):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(data.decode("utf-8"), "html.parser")
+    content_div = soup.find("div", id="main-content") or soup.find("div", class_="main-content")
+    for elem in content_div.find_all(["script", "style", "footer"]):
+        elem.decompose()
+    return content_div.get_text(separator=" ", strip=True)
+
+
+def lean_search(data):
+    return main.feed_html(main.ResultLinkParser(), chunked(data)).href
+
+
+def lean_article(data):
+    return main.feed_html(main.MainContentParser(main.scraped_text_sufficient), chunked(data)).text()
+
+
+def measure(func, data, repeat):
+    """(ms per call, peak KiB, bytes read, result)"""
+    chunked.consumed = len(data)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(data)
+    elapsed = (time.perf_counter() - start) / repeat
+    read = chunked.consumed
+    tracemalloc.start()
+    func(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed * 1000, peak / 1024, read, result
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="MedlinePlus extraction benchmark")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    try:
+        import bs4  # noqa: F401
+        has_bs4 = True
+    except ImportError:
+        has_bs4 = False
+        print("beautifulsoup4 not installed: showing the streaming parsers only")
+
+    cases = [
+        ("search page", "medlineplus_search.html", legacy_search, lean_search),
+        ("article page", "medlineplus_article.html", legacy_article, lean_article),
+    ]
+    print(f"{'page':<14}{'bytes':>8}{'impl':>8}{'ms/page':>10}{'peak KiB':>10}{'read':>9}")
+    for name, filename, legacy, lean in cases:
+        with open(os.path.join(FIXTURES, filename), "rb") as f:
+            data = f.read()
+        results = {}
+        impls = [("before", legacy), ("after", lean)] if has_bs4 else [("after", lean)]
+        for label, func in impls:
+            ms, peak, read, results[label] = measure(func, data, args.repeat)
+            print(f"{name:<14}{len(data):>8}{label:>8}{ms:>10.2f}{peak:>10.0f}{read:>9}")
+        if has_bs4:
+            same = main.safe_content(results["before"]) == main.safe_content(results["after"])
+            print(f"{'':<14}cached snippet identical: {same}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,90 @@
+"""Benchmark: plain decoding vs speculative decoding on CPU.
+
+Loads the real GGUF once per mode and generates replies for grounded chat
+prompts (built with main.build_prompt from the benchmark snippets). Decoding
+is greedy, so every mode should produce the same text; the report shows the
+share of replies identical to plain decoding, end-to-end tokens/sec
+(prompt eval included) and, for draft modes, the draft acceptance rate.
+
+Run from docs/backend:
+    python bench_speculative.py --model models/tinyllama-1.1b-chat-v1.0.Q8_0.gguf --prompts 8
+    python bench_speculative.py --modes off prompt_lookup --num-pred-tokens 2 4 10
+    python bench_speculative.py --modes off draft_model --model big.gguf --draft-model small.gguf
+"""
+import argparse
+import time
+
+import main
+from bench_fakes import SNIPPETS
+from bench_load import QUESTIONS
+
+
+def grounded_prompts(count):
+    prompts = []
+    for i in range(count):
+        sources = [
+            {"desc": "Medical Knowledge Hub", "content": SNIPPETS[(i + j) % len(SNIPPETS)], "url": None}
+            for j in range(3)
+        ]
+        prompts.append(main.build_prompt([], QUESTIONS[i % len(QUESTIONS)], sources))
+    return prompts
+
+
+def run_mode(args, mode, num_pred_tokens, prompts):
+    main.DRAFT_NUM_PRED_TOKENS = num_pred_tokens
+    model = main.load_llm(args.model, args.n_ctx, args.threads, mode, args.draft_model)
+    kwargs = dict(main.GENERATION_KWARGS, max_tokens=args.max_tokens, temperature=0.0)
+    draft = getattr(model, "draft_model", None)
+    texts, tokens, accepted, proposed = [], 0, 0, 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        model.reset()  # Same cold prompt eval in every mode
+        calls_before, proposed_before = (draft.calls, draft.proposed) if draft else (0, 0)
+        result = model(prompt, **kwargs)
+        generated = result["usage"]["completion_tokens"]
+        texts.append(result["choices"][0]["text"])
+        tokens += generated
+        if draft:
+            calls, drafted = draft.calls - calls_before, draft.proposed - proposed_before
+            proposed += drafted
+            accepted += main.accepted_draft_tokens(calls, drafted, generated)
+    elapsed = time.perf_counter() - start
+    return texts, {
+        "tokens": tokens,
+        "elapsed_s": elapsed,
+        "tokens_per_sec": tokens / elapsed if elapsed else 0.0,
+        "acceptance": accepted / proposed if proposed else None,
+        "proposed": proposed
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model", default=main.MODEL_TIERS[0].path)
+    parser.add_argument("--draft-model", default=main.DRAFT_MODEL_PATH, help="Small GGUF for --modes draft_model")
+    parser.add_argument("--modes", nargs="+", default=["off", "prompt_lookup"],
+                        choices=["off", "prompt_lookup", "draft_model"])
+    parser.add_argument("--num-pred-tokens", type=int, nargs="+", default=[main.DRAFT_NUM_PRED_TOKENS])
+    parser.add_argument("--prompts", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=main.GENERATE_TOKENS)
+    parser.add_argument("--n-ctx", type=int, default=main.CONTEXT_WINDOW)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    prompts = grounded_prompts(args.prompts)
+    baseline = None
+    print(f"{'mode':<15}{'draft':>6}{'tokens':>8}{'tok/s':>9}{'speedup':>9}{'accept':>8}{'same':>7}")
+    for mode in args.modes:
+        for num_pred_tokens in ([0] if mode == "off" else args.num_pred_tokens):
+            texts, stats = run_mode(args, mode, num_pred_tokens, prompts)
+            if baseline is None and mode == "off":
+                baseline = (texts, stats)
+            speedup = stats["tokens_per_sec"] / baseline[1]["tokens_per_sec"] if baseline else float("nan")
+            same = sum(a == b for a, b in zip(texts, baseline[0])) / len(texts) if baseline else float("nan")
+            acceptance = f"{stats['acceptance']:.0%}" if stats["acceptance"] is not None else "-"
+            print(f"{mode:<15}{num_pred_tokens or '-':>6}{stats['tokens']:>8}{stats['tokens_per_sec']:>9.2f}"
+                  f"{speedup:>9.2f}{acceptance:>8}{same:>7.0%}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,160 @@
+"""Measure memory and throughput of serve.py for different worker counts.
+
+For each worker count this starts serve.py, waits for /ready, drives /chat
+with concurrent clients and samples memory of the worker processes from
+/proc (Linux). PSS is the number to compare: it splits the shared,
+memory-mapped model pages between processes, while RSS counts them in full
+for every worker.
+
+Questions are made unique by default so every request is generated rather than
+served from the response cache; pass --no-unique to measure cache hits.
+--offline serves StubLlama against a local FakeUpstream (see bench_fakes.py)
+instead of the real model and upstream APIs.
+
+Run from docs/backend:
+    python bench_workers.py --workers 1 2 4 --requests 40 --concurrency 8
+    python bench_workers.py --offline --tokens-per-sec 20 --upstream-latency 0.15
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_fakes import FakeUpstream
+from bench_load import question
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def child_pids(pid):
+    """Direct children of a process (uvicorn's worker processes)"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+def memory_kb(pid):
+    """(rss_kb, pss_kb) from smaps_rollup"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0]] = int(parts[1])
+    return values.get("Rss:", 0), values.get("Pss:", 0)
+
+
+def wait_ready(base_url, workers, timeout):
+    """/ready is answered by whichever worker accepts, so require a run of successes"""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        try:
+            streak = streak + 1 if requests.get(f"{base_url}/ready", timeout=2).status_code == 200 else 0
+        except requests.RequestException:
+            streak = 0
+        if streak >= workers * 3:
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def drive(base_url, total, concurrency, unique=True):
+    def one(i):
+        start = time.monotonic()
+        resp = requests.post(f"{base_url}/chat", json={"message": question(i, unique), "history": []}, timeout=300)
+        return resp.status_code == 200 and "reply" in resp.json(), time.monotonic() - start
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.monotonic() - start
+    latencies = sorted(latency for ok, latency in results if ok)
+    return sum(ok for ok, _ in results), elapsed, latencies
+
+
+def server_command(workers, port, offline):
+    """serve.py normally; offline, uvicorn with the bench_fakes app factory"""
+    if not offline:
+        return [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port)]
+    return [sys.executable, "-m", "uvicorn", "bench_fakes:offline_app", "--factory", "--workers", str(workers),
+            "--host", "127.0.0.1", "--port", str(port), "--app-dir", BACKEND_DIR, "--log-level", "warning"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--unique", action=argparse.BooleanOptionalAction, default=True,
+                        help="Make every question unique so requests are generated, not served from cache")
+    parser.add_argument("--offline", action="store_true", help="Use StubLlama and a local FakeUpstream")
+    parser.add_argument("--upstream-latency", type=float, default=0.15, help="Offline: mean upstream latency (s)")
+    parser.add_argument("--tokens-per-sec", type=float, default=20.0, help="Offline: stub LLM decode speed")
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=400.0, help="Offline: stub LLM prompt eval speed")
+    args = parser.parse_args()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    env = dict(os.environ, WARMUP="1")
+    upstream = None
+    if args.offline:
+        upstream = FakeUpstream(args.upstream_latency).start()
+        model_file = tempfile.NamedTemporaryFile(suffix=".gguf", delete=False)
+        model_file.close()
+        env.update({
+            "MODEL_PATH": model_file.name,
+            "BENCH_UPSTREAM_URLS": json.dumps(upstream.urls()),
+            "BENCH_TOKENS_PER_SEC": str(args.tokens_per_sec),
+            "BENCH_PROMPT_TOKENS_PER_SEC": str(args.prompt_tokens_per_sec),
+        })
+
+    print(f"{'workers':>7} {'ok':>5} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'RSS MB':>9} {'PSS MB':>9}")
+    for workers in args.workers:
+        env["WEB_CONCURRENCY"] = str(workers)
+        server = subprocess.Popen(server_command(workers, args.port, args.offline), cwd=BACKEND_DIR, env=env)
+        try:
+            if not wait_ready(base_url, workers, args.startup_timeout):
+                print(f"{workers:>7} server never became ready")
+                continue
+            ok, elapsed, latencies = drive(base_url, args.requests, args.concurrency, args.unique)
+            rss = pss = 0
+            for pid in child_pids(server.pid):
+                try:
+                    r, p = memory_kb(pid)
+                except OSError:
+                    continue
+                rss += r
+                pss += p
+            p50 = latencies[len(latencies) // 2] if latencies else float("nan")
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else float("nan")
+            print(f"{workers:>7} {ok:>5} {ok / elapsed:>7.2f} {p50:>7.2f} {p95:>7.2f} {rss / 1024:>9.0f} {pss / 1024:>9.0f}")
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+    if upstream:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""Offline BM25 index over the clinical data bundled with the frontend.
+
+The DSM-5, medication and fallback datasets in docs/*.js are extracted into a
+compact binary inverted index that the backend memory-maps at startup.
+
+Build (from docs/backend):  python local_index.py [--out local_knowledge.idx]
+"""
+import argparse
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+
+logger = logging.getLogger("SAWA-MEDICAL")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_knowledge.idx")
+
+MAGIC = b"SAWAIDX1"
+INDEX_VERSION = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "in", "is", "it", "know", "me", "my", "of", "on", "or", "please",
+    "should", "tell", "that", "the", "this", "to", "was", "what", "when", "which", "who",
+    "why", "with", "you", "your"
+}
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+# Minimal parser for the JS object literals in the data files
+class JSLiteralParser:
+    """Parses object/array/string/number literals with unquoted keys, comments and trailing commas"""
+
+    def __init__(self, text, pos=0):
+        self.text = text
+        self.pos = pos
+
+    def skip(self):
+        while self.pos < len(self.text):
+            if self.text.startswith("//", self.pos):
+                end = self.text.find("\n", self.pos)
+                self.pos = len(self.text) if end == -1 else end
+            elif self.text.startswith("/*", self.pos):
+                self.pos = self.text.index("*/", self.pos) + 2
+            elif self.text[self.pos].isspace():
+                self.pos += 1
+            else:
+                break
+
+    def value(self):
+        self.skip()
+        ch = self.text[self.pos]
+        if ch == "{":
+            return self.obj()
+        if ch == "[":
+            return self.arr()
+        if ch in "\"'`":
+            return self.string()
+        match = re.compile(r"-?\d+(\.\d+)?|true|false|null").match(self.text, self.pos)
+        if not match:
+            raise ValueError(f"Unsupported literal at offset {self.pos}")
+        self.pos = match.end()
+        token = match.group()
+        literals = {"true": True, "false": False, "null": None}
+        return literals[token] if token in literals else float(token)
+
+    def string(self):
+        quote = self.text[self.pos]
+        self.pos += 1
+        out = []
+        while self.text[self.pos] != quote:
+            ch = self.text[self.pos]
+            if ch == "\\":
+                self.pos += 1
+                ch = {"n": "\n", "t": "\t"}.get(self.text[self.pos], self.text[self.pos])
+            out.append(ch)
+            self.pos += 1
+        self.pos += 1
+        return "".join(out)
+
+    def key(self):
+        self.skip()
+        if self.text[self.pos] in "\"'":
+            return self.string()
+        match = re.compile(r"[A-Za-z_$][\w$]*").match(self.text, self.pos)
+        if not match:
+            raise ValueError(f"Bad object key at offset {self.pos}")
+        self.pos = match.end()
+        return match.group()
+
+    def obj(self):
+        result = {}
+        self.pos += 1
+        while True:
+            self.skip()
+            if self.text[self.pos] == "}":
+                self.pos += 1
+                return result
+            key = self.key()
+            self.skip()
+            if self.text[self.pos] != ":":
+                raise ValueError(f"Expected ':' at offset {self.pos}")
+            self.pos += 1
+            self.skip()
+            if self.text.startswith("function", self.pos):
+                raise ValueError(f"Function literal at offset {self.pos}")
+            result[key] = self.value()
+            self.skip()
+            if self.text[self.pos] == ",":
+                self.pos += 1
+
+    def arr(self):
+        result = []
+        self.pos += 1
+        while True:
+            self.skip()
+            if self.text[self.pos] == "]":
+                self.pos += 1
+                return result
+            result.append(self.value())
+            self.skip()
+            if self.text[self.pos] == ",":
+                self.pos += 1
+
+
+def parse_js_assignment(text, name):
+    """Parse the object literal assigned to `name` (e.g. "const dsm5Disorders" or "window.fallbackData")"""
+    match = re.search(re.escape(name) + r"\s*=\s*\{", text)
+    if not match:
+        raise ValueError(f"{name} not found")
+    return JSLiteralParser(text, match.end() - 1).value()
+
+
+def as_list(value):
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return [str(value)] if value else []
+
+
+def extract_documents(data_dir=DATA_DIR):
+    """Flatten the bundled datasets into (title, source, snippet, index_text, key_text) records.
+
+    key_text holds the fields that say what a document is about (title,
+    synonyms, indications); side effects and warnings are not indexed, so a
+    lone symptom does not pull in every drug that can cause it.
+    """
+    docs = []
+
+    def read(name):
+        with open(os.path.join(data_dir, name), encoding="utf-8") as f:
+            return f.read()
+
+    for key, entry in parse_js_assignment(read("dsm5-data.js"), "const dsm5Disorders").items():
+        title = entry.get("name", key)
+        snippet = f"{title}: {entry.get('description', '')}"
+        synonyms = as_list(entry.get("synonyms"))
+        extra = as_list(entry.get("symptoms")) + synonyms + [key]
+        docs.append((title, "DSM-5", snippet, " ".join([title, snippet] + extra), " ".join([title, key] + synonyms)))
+
+    for key, entry in parse_js_assignment(read("medications-data.js"), "const medicationDatabase").items():
+        title = entry.get("name", key)
+        uses = ", ".join(as_list(entry.get("commonUses")))
+        snippet = f"{title} ({entry.get('type', '')}): used for {uses}. {entry.get('importantNotes', '')}"
+        docs.append((title, "Medications", snippet, " ".join([title, snippet, key]), " ".join([title, key, uses])))
+
+    fallback = parse_js_assignment(read("fallback-data.js"), "window.fallbackData")
+    for key, entry in fallback.get("dsm5", {}).items():
+        snippet = f"{key}: {entry.get('description', '')}"
+        extra = [entry.get("criteria", ""), entry.get("treatment", "")]
+        synonyms = as_list(entry.get("synonyms"))
+        extra += as_list(entry.get("symptoms")) + as_list(entry.get("medications")) + synonyms
+        docs.append((key, "DSM-5", snippet, " ".join([key, snippet] + extra), " ".join([key] + synonyms)))
+    for key, definition in fallback.get("dictionary", {}).items():
+        snippet = f"{key}: {definition}"
+        docs.append((key, "Glossary", snippet, f"{key} {snippet}", key))
+    for key, steps in fallback.get("walkthroughs", {}).items():
+        snippet = f"{key}: " + " ".join(as_list(steps)[:2])
+        docs.append((key, "Program Guide", snippet, " ".join([key, key] + as_list(steps)), key))
+
+    return dedupe_documents(docs)
+
+
+def dedupe_documents(docs):
+    """Merge records with the same title (e.g. a disorder in both dsm5-data.js and fallback-data.js)"""
+    merged = {}
+    for title, source, snippet, text, key_text in docs:
+        name = title.strip().lower()
+        if name in merged:
+            first = merged[name]
+            merged[name] = (first[0], first[1], first[2], f"{first[3]} {text}", f"{first[4]} {key_text}")
+        else:
+            merged[name] = (title, source, snippet, text, key_text)
+    return list(merged.values())
+
+
+def build_index(docs, path):
+    """Write the BM25 index: magic, header length, JSON header, then uint32 (doc, tf) postings"""
+    postings = {}
+    doc_meta = []
+    total_len = 0
+    for doc_id, (title, source, snippet, text, key_text) in enumerate(docs):
+        tokens = tokenize(text)
+        total_len += len(tokens)
+        doc_meta.append([title, source, snippet, len(tokens), sorted(set(tokenize(key_text)))])
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            postings.setdefault(token, []).append((doc_id, tf))
+
+    flat = array("I")
+    terms = {}
+    for token in sorted(postings):
+        terms[token] = [len(flat), len(postings[token])]
+        for doc_id, tf in postings[token]:
+            flat.extend((doc_id, tf))
+    if sys.byteorder != "little":
+        flat.byteswap()
+
+    header = json.dumps({
+        "version": INDEX_VERSION,
+        "avgdl": total_len / max(1, len(docs)),
+        "docs": doc_meta,
+        "terms": terms
+    }, separators=(",", ":")).encode("utf-8")
+    # Pad so the postings start on a 4-byte boundary for the uint32 view
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 4)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.write(flat.tobytes())
+    os.replace(tmp_path, path)
+    return len(docs), len(terms)
+
+
+class LocalIndex:
+    """Read-only, memory-mapped view of an index written by build_index"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a local knowledge index")
+        (header_len,) = struct.unpack_from("<I", self.mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self.mm[start:start + header_len])
+        if header["version"] != INDEX_VERSION:
+            raise ValueError(f"{path} has index version {header['version']}, expected {INDEX_VERSION}")
+        self.docs = header["docs"]
+        self.terms = header["terms"]
+        self.avgdl = header["avgdl"] or 1.0
+        self.key_terms = [set(doc[4]) for doc in self.docs]
+        self.postings = memoryview(self.mm)[start + header_len:].cast("I")
+
+    def __len__(self):
+        return len(self.docs)
+
+    def search(self, query, k=3):
+        """Top-k BM25 matches as dicts with title, source, content, score, coverage and key_coverage.
+
+        coverage is the share of the query's IDF mass that the document matched;
+        key_coverage counts only matches on its title, synonyms and indications.
+        """
+        n_docs = len(self.docs)
+        scores = {}
+        matched = {}
+        key_matched = {}
+        total_idf = 0.0
+        for token in set(tokenize(query)):
+            entry = self.terms.get(token)
+            if not entry:
+                total_idf += math.log(1 + (n_docs + 0.5) / 0.5)  # Unknown term: maximal IDF
+                continue
+            offset, df = entry
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            total_idf += idf
+            for i in range(offset, offset + 2 * df, 2):
+                doc_id, tf = self.postings[i], self.postings[i + 1]
+                doc_len = self.docs[doc_id][3]
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len / self.avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+                matched[doc_id] = matched.get(doc_id, 0.0) + idf
+                if token in self.key_terms[doc_id]:
+                    key_matched[doc_id] = key_matched.get(doc_id, 0.0) + idf
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [
+            {
+                "title": self.docs[d][0], "source": self.docs[d][1], "content": self.docs[d][2],
+                "score": round(s, 3), "coverage": round(matched[d] / total_idf, 3),
+                "key_coverage": round(key_matched.get(d, 0.0) / total_idf, 3)
+            }
+            for d, s in best
+        ]
+
+
+def load_or_build(path=DEFAULT_INDEX_PATH, data_dir=DATA_DIR):
+    """Map the index, building it first from the bundled data if it is missing"""
+    try:
+        if os.path.exists(path):
+            try:
+                return LocalIndex(path)
+            except ValueError as e:
+                logger.info(f"Rebuilding local knowledge index: {e}")
+        count, vocab = build_index(extract_documents(data_dir), path)
+        logger.info(f"Local knowledge index built: {count} docs, {vocab} terms")
+        return LocalIndex(path)
+    except Exception as e:
+        logger.warning(f"Local knowledge index unavailable: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline knowledge index from docs/*.js")
+    parser.add_argument("--out", default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--query", help="Run a test query against the built index")
+    args = parser.parse_args()
+
+    count, vocab = build_index(extract_documents(args.data_dir), args.out)
+    print(f"Wrote {args.out}: {count} docs, {vocab} terms, {os.path.getsize(args.out)} bytes")
+    if args.query:
+        for hit in LocalIndex(args.out).search(args.query):
+            print(f"{hit['score']:7.3f} {hit['coverage']:5.2f}  [{hit['source']}] {hit['content'][:100]}")
@@ -1,24 +1,60 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from llama_cpp import Llama
+try:
+    from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+except ImportError:  # llama-cpp-python without speculative decoding
+    LlamaDraftModel, LlamaPromptLookupDecoding = object, None
+import numpy as np
 import requests
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
 import re
 import spacy
-nlp = spacy.load("en_core_web_sm")
 try:
     import redis
 except Exception:
     redis = None
+try:
+    from . import local_index
+except ImportError:
+    import local_index
+import codecs
+import gzip
+import asyncio
 import hashlib
 import json
 import logging
 import os
+import atexit
 import heapq
+import itertools
+import math
+import pickle
+import queue
+import secrets
+import shutil
+import tempfile
+import threading
 import time
+import zlib
+import cProfile
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Components load in the background (see initialize_components) so the server answers at once
+    threading.Thread(target=initialize_components, name="startup", daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,50 +68,706 @@ app.add_middleware(
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("SAWA-MEDICAL")
 
+# Metrics: minimal Prometheus-format registry (no client library dependency)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 100)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+STAGE_SECONDS = Histogram("sawa_stage_seconds", "Time spent in each stage of a chat request")
+UPSTREAM_SECONDS = Histogram("sawa_upstream_seconds", "Uncached upstream fetch latency by source")
+TOKENS_PER_SECOND = Histogram("sawa_decode_tokens_per_second", "Decode speed per generation", RATE_BUCKETS)
+GENERATED_TOKENS = Counter("sawa_generated_tokens_total", "Tokens decoded by the LLM")
+REQUESTS = Counter("sawa_requests_total", "Chat requests by endpoint and outcome")
+SINGLE_FLIGHT = Counter("sawa_single_flight_total", "Single-flight calls by flight and role (leader or coalesced)")
+ROUTED = Counter("sawa_routed_requests_total", "Requests admitted per model tier, and whether they fell back from a larger one")
+CANCELLED = Counter("sawa_cancelled_requests_total", "Requests abandoned by the client, by endpoint and stage reached")
+TOKENS_SAVED = Counter("sawa_cancelled_tokens_saved_total", "Decode tokens skipped because the client went away")
+SOURCE_SKIPPED = Counter("sawa_source_skipped_total", "Upstream calls skipped by an open breaker or a 429 cool-down, by source")
+DRAFT_TOKENS = Counter("sawa_draft_tokens_total", "Speculative decoding draft tokens by result (proposed or accepted)")
+METRICS = [
+    STAGE_SECONDS, UPSTREAM_SECONDS, TOKENS_PER_SECOND, GENERATED_TOKENS, REQUESTS, SINGLE_FLIGHT,
+    CANCELLED, TOKENS_SAVED, ROUTED, DRAFT_TOKENS, SOURCE_SKIPPED
+]
+
+# Per-request span timings (ms), shown in the response "timings"
+current_trace = ContextVar("current_trace", default=None)
+
+def start_trace():
+    trace = {}
+    current_trace.set(trace)
+    return trace
+
+def observe_stage(name, seconds, trace=None):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = trace if trace is not None else current_trace.get()
+    if trace is not None:
+        trace[f"{name}_ms"] = round(trace.get(f"{name}_ms", 0.0) + seconds * 1000, 1)
+
+# Client-disconnect cancellation: /chat sets this event when the client goes away
+# and the pipeline checks it between stages and between decoded tokens
+CANCEL_POLL_INTERVAL = 0.1  # seconds
+current_cancel = ContextVar("current_cancel", default=None)
+
+class RequestCancelled(Exception):
+    """The client disconnected; remaining work for the request is skipped"""
+
+    def __init__(self, stage="grounding"):
+        super().__init__(f"Client disconnected during {stage}")
+        self.stage = stage
+
+def is_cancelled():
+    event = current_cancel.get()
+    return event is not None and event.is_set()
+
+def check_cancelled(stage="grounding"):
+    if is_cancelled():
+        raise RequestCancelled(stage)
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current request"""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.monotonic() - start)
+
+# Opt-in sampling profiler: PROFILE_SAMPLE_RATE=N profiles 1 in N /chat requests
+PROFILE_SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+profile_counter = itertools.count(1)
+profile_lock = threading.Lock()  # Only one profiler can be active per process
+
+@contextmanager
+def maybe_profile():
+    """cProfile the request thread for sampled requests and dump a .prof file.
+
+    Only the calling thread is profiled: grounding fetches and generation run
+    on pool threads, so their time shows up as waits. A sampled request is
+    skipped while another profile (or another profiling tool) is active.
+    """
+    n = next(profile_counter)
+    if PROFILE_SAMPLE_RATE <= 0 or n % PROFILE_SAMPLE_RATE or not profile_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            logger.warning(f"Profiling skipped: {e}")
+            profiler = None
+        if profiler is None:
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                path = os.path.join(PROFILE_DIR, f"chat-{int(time.time())}-{n}.prof")
+                profiler.dump_stats(path)
+                logger.info(f"Request profile written to {path}")
+            except Exception as e:
+                logger.warning(f"Profile dump failed: {e}")
+    finally:
+        profile_lock.release()
+
+# spaCy pipeline: every stage disables the components it does not read
+nlp = None  # Loaded by initialize_components()
+KEY_TERM_DISABLE = []  # Noun chunks + entities: lemmatizer not needed
+EXPANSION_DISABLE = []  # Dependency parse + lemmas: NER not needed
+
+def load_spacy():
+    global nlp, KEY_TERM_DISABLE, EXPANSION_DISABLE
+    model = spacy.load(os.getenv("SPACY_MODEL", "en_core_web_sm"), exclude=["senter"])
+    KEY_TERM_DISABLE = [p for p in ("lemmatizer",) if p in model.pipe_names]
+    EXPANSION_DISABLE = [p for p in ("ner",) if p in model.pipe_names]
+    nlp = model
+
 # Token management settings
 CONTEXT_WINDOW = 1024
 GENERATE_TOKENS = 200
 MAX_PROMPT_TOKENS = CONTEXT_WINDOW - GENERATE_TOKENS  # 824 tokens
 HISTORY_LIMIT = 1  # Only keep last exchange
 
-# Initialize LLM with memory optimization
-llm = None  # Initialize as None for error handling
-try:
-    model_path = os.getenv("MODEL_PATH", "models/tinyllama-1.1b-chat-v1.0.Q8_0.gguf")
-    if os.path.exists(model_path):
-        llm = Llama(
+# Sampling settings shared by /chat and /chat/stream
+GENERATION_KWARGS = {
+    "max_tokens": GENERATE_TOKENS,
+    "stop": ["User:", "AI:", "###"],
+    "temperature": 0.3,  # More deterministic
+    "repeat_penalty": 1.2  # Reduce repetition
+}
+
+# Constant instruction block: every prompt starts with it, so its KV state is
+# evaluated once per worker and restored instead of re-evaluated
+SYSTEM_PROMPT = (
+    "You are a clinical expert. Provide concise, evidence-based responses.\n"
+    "Format:\n"
+    "**Summary**: 1-2 sentence clinical action\n"
+    "**Recommendations**: Step-by-step management\n"
+    "**Monitoring**: Key parameters to watch\n\n"
+    "[Relevant Knowledge]:\n"
+)
+PREFIX_CACHE = os.getenv("PREFIX_CACHE", "1") == "1"
+
+# Inference scheduling: each worker owns its own Llama instance
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "1"))
+LLM_QUEUE_DEPTH = int(os.getenv("LLM_QUEUE_DEPTH", "8"))  # Requests allowed to wait for a worker
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))  # seconds
+
+# Memory-mapped weights live in the page cache, so every uvicorn worker process
+# (and every LLM_WORKERS instance) shares one copy of the GGUF
+MODEL_USE_MMAP = os.getenv("MODEL_USE_MMAP", "1") == "1"
+
+# Speculative decoding: "off", "prompt_lookup" (n-gram drafts copied from the prompt, which
+# repeats the grounding sources) or "draft_model" (a small GGUF with the same vocabulary)
+SPECULATIVE_DECODING = os.getenv("SPECULATIVE_DECODING", "off")
+DRAFT_NUM_PRED_TOKENS = int(os.getenv("DRAFT_NUM_PRED_TOKENS", "2"))  # Short drafts suit CPU; GPUs can take ~10
+DRAFT_MAX_NGRAM = int(os.getenv("DRAFT_MAX_NGRAM", "2"))
+DRAFT_MODEL_PATH = os.getenv("DRAFT_MODEL_PATH")
+
+class GGUFDraftModel(LlamaDraftModel):
+    """Greedy drafts from a small GGUF that shares the main model's tokenizer"""
+
+    def __init__(self, model_path, n_ctx=CONTEXT_WINDOW, num_pred_tokens=DRAFT_NUM_PRED_TOKENS, n_threads=None):
+        self.model = Llama(
             model_path=model_path,
-            n_ctx=CONTEXT_WINDOW,
-            n_threads=4,
+            n_ctx=n_ctx,
+            n_threads=n_threads or LLM_THREADS,
             n_batch=512,
-            use_mmap=False
+            use_mmap=MODEL_USE_MMAP,
+            verbose=False
         )
-        logger.info(f"LLM model loaded: {model_path}")
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        # generate() reuses the draft model's KV cache for the common prefix
+        drafted = []
+        tokens = self.model.generate(input_ids.tolist(), temp=0.0)
+        try:
+            for token in tokens:
+                drafted.append(token)
+                if len(drafted) >= self.num_pred_tokens:
+                    break
+        finally:
+            tokens.close()
+        return np.array(drafted, dtype=np.intc)
+
+class CountingDraftModel(LlamaDraftModel):
+    """Wraps a draft model and counts calls and proposed tokens"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = 0
+        self.proposed = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = self.inner(input_ids, **kwargs)
+        self.calls += 1
+        self.proposed += len(draft)
+        return draft
+
+def accepted_draft_tokens(calls, proposed, tokens):
+    """Draft tokens kept during one generation.
+
+    llama-cpp evaluates the prompt, then drafts before each further forward
+    pass; every pass yields one sampled token plus the accepted draft tokens.
+    """
+    return max(0, min(proposed, tokens - calls - 1))
+
+def make_draft_model(mode=SPECULATIVE_DECODING, n_ctx=CONTEXT_WINDOW, draft_path=DRAFT_MODEL_PATH, n_threads=None):
+    if mode in ("", "off"):
+        return None
+    if LlamaPromptLookupDecoding is None:
+        logger.warning("Installed llama-cpp-python has no speculative decoding, decoding normally")
+        return None
+    if mode == "prompt_lookup":
+        inner = LlamaPromptLookupDecoding(max_ngram_size=DRAFT_MAX_NGRAM, num_pred_tokens=DRAFT_NUM_PRED_TOKENS)
+    elif mode == "draft_model":
+        if not draft_path or not os.path.exists(draft_path):
+            raise FileNotFoundError(f"Draft model file not found: {draft_path}")
+        inner = GGUFDraftModel(draft_path, n_ctx, DRAFT_NUM_PRED_TOKENS, n_threads)
     else:
-        logger.error(f"Model file not found: {model_path}")
-except Exception as e:
-    logger.error(f"Model loading failed: {e}")
+        raise ValueError(f"Unknown SPECULATIVE_DECODING mode: {mode}")
+    return CountingDraftModel(inner)
+
+def load_llm(model_path, n_ctx=CONTEXT_WINDOW, n_threads=None, speculative=SPECULATIVE_DECODING, draft_path=DRAFT_MODEL_PATH):
+    kwargs = {}
+    draft_model = make_draft_model(speculative, n_ctx, draft_path, n_threads)
+    if draft_model:
+        kwargs["draft_model"] = draft_model  # Also makes llama-cpp keep logits for every position
+    return Llama(
+        model_path=model_path,
+        n_ctx=n_ctx,
+        n_threads=n_threads or LLM_THREADS,
+        n_batch=512,
+        use_mmap=MODEL_USE_MMAP,
+        **kwargs
+    )
+
+# LLM workers, set by load_models() during startup
+llm = None  # Initialize as None for error handling
+llm_instances = []
+llm_tiers = []  # Loaded ModelTiers, smallest first
+
+# Saved system-prompt state per model instance: id(model) -> (tokens, state)
+prefix_states = {}
+
+def compact_state(state):
+    """Drop all but the last row of a saved state's logits.
+
+    llama-cpp-python copies up to n_batch x n_vocab float32 scores into every
+    state (tens of MB). load_state broadcasts a single row back, and the last
+    prompt token is always re-evaluated, so the other rows are never read.
+    """
+    scores = getattr(state, "scores", None)
+    if scores is not None and len(scores) > 1:
+        state.scores = scores[-1:].copy()
+    return state
+
+def prime_prefix_state(model):
+    """Evaluate SYSTEM_PROMPT once and keep the resulting KV state"""
+    tokens = model.tokenize(SYSTEM_PROMPT.encode("utf-8"))
+    model.reset()
+    model.eval(tokens)
+    prefix_states[id(model)] = (list(tokens), compact_state(model.save_state()))
+
+def ensure_prefix_state(model, entry=None):
+    """Restore a saved (tokens, state), by default the system-prompt one, unless the model still holds it.
+
+    llama-cpp reuses the longest common token prefix with what is already
+    evaluated, so after this only the per-request part of the prompt is run.
+    """
+    entry = entry or prefix_states.get(id(model))
+    if entry is None:
+        return
+    tokens, state = entry
+    if model.n_tokens >= len(tokens) and list(model.input_ids[:len(tokens)]) == tokens:
+        return
+    model.load_state(state)
+
+class SchedulerSaturated(Exception):
+    """Raised when the inference queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class InferenceTicket:
+    """An admitted request: holds a queue slot until released"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.tier = scheduler.tier
+        self.queue_wait = 0.0
+        self.generation = 0.0
+        self.released = False
+
+    @contextmanager
+    def model(self, state=None):
+        """Check out a worker's model for the duration of one generation, restoring `state` if given"""
+        start = time.monotonic()
+        try:
+            model = self.scheduler.models.get(timeout=LLM_QUEUE_TIMEOUT)
+        except queue.Empty:
+            raise SchedulerSaturated(self.scheduler.retry_after())
+        self.queue_wait = time.monotonic() - start
+        try:
+            ensure_prefix_state(model, state)
+            yield model
+        finally:
+            self.generation = time.monotonic() - start - self.queue_wait
+            self.scheduler.models.put(model)
+            self.scheduler.record(self.queue_wait, self.generation)
+
+    def timings(self) -> dict:
+        return {
+            "queue_wait_ms": round(self.queue_wait * 1000, 1),
+            "generation_ms": round(self.generation * 1000, 1)
+        }
+
+    def release(self):
+        """Free the queue slot; safe to call more than once and from any thread"""
+        self.scheduler.finish(self)
+
+class InferenceScheduler:
+    """Bounded admission in front of a pool of model workers.
+
+    At most len(models) requests generate at once and LLM_QUEUE_DEPTH more may
+    wait; anything beyond that is rejected immediately with a retry hint.
+    """
+
+    def __init__(self, models, queue_depth=LLM_QUEUE_DEPTH, tier=None):
+        self.tier = tier
+        self.models = queue.Queue()
+        for model in models:
+            self.models.put(model)
+        self.workers = len(models)
+        self.capacity = self.workers + queue_depth
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"admitted": 0, "rejected": 0}
+        self.avg_queue_wait = 0.0
+        self.avg_generation = 1.0  # Seed estimate (seconds) until real samples arrive
+
+    def admit(self) -> InferenceTicket:
+        with self.lock:
+            if self.in_flight >= self.capacity:
+                self.stats["rejected"] += 1
+                raise SchedulerSaturated(self._retry_after())
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+        return InferenceTicket(self)
+
+    def finish(self, ticket):
+        with self.lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self.in_flight -= 1
+
+    def has_room(self) -> bool:
+        with self.lock:
+            return self.in_flight < self.capacity
+
+    def record(self, queue_wait, generation):
+        with self.lock:
+            self.avg_queue_wait = 0.8 * self.avg_queue_wait + 0.2 * queue_wait
+            self.avg_generation = 0.8 * self.avg_generation + 0.2 * generation
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self.avg_generation * self.in_flight / self.workers))
+
+    def retry_after(self) -> int:
+        with self.lock:
+            return self._retry_after()
+
+    def snapshot_stats(self) -> dict:
+        with self.lock:
+            return dict(
+                self.stats,
+                workers=self.workers,
+                capacity=self.capacity,
+                in_flight=self.in_flight,
+                avg_queue_wait_ms=round(self.avg_queue_wait * 1000, 1),
+                avg_generation_ms=round(self.avg_generation * 1000, 1)
+            )
+
+llm_scheduler = None  # Scheduler of the smallest loaded tier
+
+# Model tiers: MODEL_TIERS is a JSON list, smallest model first, e.g.
+# [{"name": "small", "path": "models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf", "workers": 2},
+#  {"name": "large", "path": "models/llama-3-8b.Q4_K_M.gguf", "n_ctx": 2048, "min_score": 3}]
+# Without it there is one tier built from MODEL_PATH / LLM_WORKERS / LLM_QUEUE_DEPTH.
+DEFAULT_MODEL_PATH = "models/tinyllama-1.1b-chat-v1.0.Q8_0.gguf"
+
+class ModelTier:
+    """One GGUF configuration with its own workers and admission limits.
+
+    A query goes to the largest tier whose min_score its complexity reaches.
+    """
+
+    def __init__(self, name, path, n_ctx=CONTEXT_WINDOW, workers=1, queue_depth=LLM_QUEUE_DEPTH,
+                 min_score=0.0, threads=None, speculative=SPECULATIVE_DECODING, draft_path=DRAFT_MODEL_PATH):
+        self.name = name
+        self.path = path
+        self.n_ctx = n_ctx
+        self.workers = max(1, workers)
+        self.queue_depth = queue_depth
+        self.min_score = min_score
+        self.threads = threads
+        self.speculative = speculative
+        self.draft_path = draft_path
+        self.instances = []
+        self.scheduler = None
+
+    @property
+    def max_prompt_tokens(self):
+        return self.n_ctx - GENERATE_TOKENS
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Model file not found: {self.path}")
+        
+        # Worker instances load in parallel; llama.cpp releases the GIL while reading weights
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            instances = list(pool.map(
+                lambda _: load_llm(self.path, self.n_ctx, self.threads, self.speculative, self.draft_path),
+                range(self.workers)
+            ))
+        logger.info(
+            f"LLM tier {self.name} loaded: {self.path} ({len(instances)} workers, n_ctx={self.n_ctx}, "
+            f"speculative={self.speculative})"
+        )
+        
+        if PREFIX_CACHE:
+            for instance in instances:
+                try:
+                    prime_prefix_state(instance)
+                except Exception as e:
+                    logger.warning(f"Prefix cache disabled for a {self.name} worker: {e}")
+        
+        self.instances = instances
+        self.scheduler = InferenceScheduler(instances, self.queue_depth, tier=self)
+
+    def snapshot_stats(self):
+        stats = {"path": self.path, "n_ctx": self.n_ctx, "min_score": self.min_score, "speculative": self.speculative}
+        if self.scheduler:
+            stats.update(self.scheduler.snapshot_stats())
+        return stats
+
+def configured_tiers():
+    spec = os.getenv("MODEL_TIERS")
+    if not spec:
+        return [ModelTier("default", os.getenv("MODEL_PATH", DEFAULT_MODEL_PATH), CONTEXT_WINDOW, LLM_WORKERS, LLM_QUEUE_DEPTH)]
+    return sorted((ModelTier(**tier) for tier in json.loads(spec)), key=lambda tier: tier.min_score)
+
+MODEL_TIERS = configured_tiers()
+
+def default_thread_count():
+    """Split the cores evenly across uvicorn processes (WEB_CONCURRENCY) and model workers of every tier"""
+    processes = int(os.getenv("WEB_CONCURRENCY", "1"))
+    workers = sum(tier.workers for tier in MODEL_TIERS)
+    return max(1, (os.cpu_count() or 4) // max(1, processes * workers))
+
+LLM_THREADS = int(os.getenv("LLM_THREADS", "0")) or default_thread_count()
+
+def load_models():
+    """Load every model tier, cache the system prompt state and start the schedulers"""
+    global llm, llm_instances, llm_scheduler, llm_tiers
+    loaded = []
+    for tier in MODEL_TIERS:
+        try:
+            tier.load()
+            loaded.append(tier)
+        except Exception as e:
+            if len(MODEL_TIERS) == 1:
+                raise
+            logger.error(f"Model tier {tier.name} failed to load: {e}")
+    if not loaded:
+        raise RuntimeError("No model tier could be loaded")
+    if prefix_states:
+        logger.info(f"System prompt state cached for {len(prefix_states)} workers")
+    
+    llm_tiers = loaded
+    llm_instances = [instance for tier in loaded for instance in tier.instances]
+    llm = loaded[0].instances[0]  # Used for tokenization only
+    segment_token_count.cache_clear()  # Drop counts estimated before the tokenizer existed
+    llm_scheduler = loaded[0].scheduler
+    size_session_states()
+
+# Query-complexity router: cheap signals pick the tier, saturation falls back to smaller tiers
+REASONING_CUES = re.compile(
+    r"\b(compar\w*|versus|vs|differential|interactions?|contraindicat\w*|mechanisms?|why|explain\w*|"
+    r"manag\w*|treat\w*|dos(e|ing|age))\b",
+    re.IGNORECASE
+)
+LOOKUP_CUES = re.compile(r"^\s*(what is|what's|what are|define|definition of|meaning of)\b", re.IGNORECASE)
+
+def query_complexity(text: str, terms: list) -> float:
+    """Length, key-term count and reasoning cues; plain definitions score lower"""
+    score = len(text.split()) / 10 + 0.5 * len(terms) + len(REASONING_CUES.findall(text))
+    if LOOKUP_CUES.match(text):
+        score -= 1
+    return score
+
+def routed_tiers(text: str, terms: list) -> list:
+    """Tiers the query's complexity allows, smallest first; the last one is preferred"""
+    score = query_complexity(text, terms)
+    return [tier for tier in llm_tiers if tier.min_score <= score] or llm_tiers[:1]
+
+def admit_routed(text: str, terms: list) -> "InferenceTicket":
+    """Admit on the tier the query's complexity selects, or the next smaller tier with room"""
+    eligible = routed_tiers(text, terms)
+    preferred = eligible[-1]
+    saturated = None
+    for tier in reversed(eligible):
+        try:
+            ticket = tier.scheduler.admit()
+        except SchedulerSaturated as e:
+            saturated = saturated or e
+            continue
+        ROUTED.inc(tier=tier.name, fallback="false" if tier is preferred else "true")
+        return ticket
+    raise saturated
+
+def ensure_capacity(tiers: list):
+    """Fail fast, before grounding, when every eligible tier is full; the real admit still follows"""
+    if not any(tier.scheduler.has_room() for tier in tiers):
+        raise SchedulerSaturated(tiers[-1].scheduler.retry_after())
+
+def busy_response(e: SchedulerSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Server busy", "detail": "Too many requests in queue", "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)}
+    )
 
 # Redis initialization
 redis_client = None
-if redis is not None:
-    try:
-        redis_client = redis.Redis(
-            host='localhost',
-            port=6379,
-            db=0,
-            socket_connect_timeout=3,
-            socket_timeout=3,
-            retry_on_timeout=True,
-            max_attempts=3
-        )
-        redis_client.ping()
-        logger.info("Redis connected")
-    except Exception as e:
-        redis_client = None
-        logger.warning(f"Redis disabled: {e}")
+
+# Values are stored as compact JSON, zlib-compressed above the threshold; the
+# first byte tags the format (untagged values are plain JSON from older writers)
+REDIS_COMPRESS_MIN_BYTES = int(os.getenv("REDIS_COMPRESS_MIN_BYTES", "512"))  # 0 disables compression
+REDIS_WRITE_QUEUE = 10000  # Pending write-backs; more are dropped
+REDIS_WRITE_BATCH = 200  # SETEXs per pipeline
+
+def encode_cache_value(value) -> bytes:
+    data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    if REDIS_COMPRESS_MIN_BYTES and len(data) >= REDIS_COMPRESS_MIN_BYTES:
+        return b"Z" + zlib.compress(data)
+    return b"J" + data
+
+def decode_cache_value(raw):
+    if raw[:1] == b"Z":
+        return json.loads(zlib.decompress(raw[1:]))
+    if raw[:1] == b"J":
+        return json.loads(raw[1:])
+    return json.loads(raw)
+
+class RedisWriteBehind:
+    """Cache writes are queued and flushed in pipelined batches by one background thread"""
+
+    def __init__(self, max_pending=REDIS_WRITE_QUEUE):
+        self.queue = queue.Queue(max_pending)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "errors": 0}
+
+    def _count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="redis-writer", daemon=True)
+            self.thread.start()
+
+    def put(self, key, ttl, value):
+        try:
+            self.queue.put_nowait((key, ttl, value))
+            self._count("queued")
+        except queue.Full:
+            self._count("dropped")
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < REDIS_WRITE_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not redis_client:
+                self._count("dropped", len(batch))
+                continue
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                for key, ttl, value in batch:
+                    pipe.setex(key, int(ttl), encode_cache_value(value))
+                pipe.execute()
+                self._count("written", len(batch))
+            except Exception as e:
+                self._count("errors")
+                logger.warning(f"Cache write-back failed: {e}")
+
+    def snapshot_stats(self):
+        with self.lock:
+            return dict(self.stats, pending=self.queue.qsize())
+
+redis_writer = RedisWriteBehind()
+
+def redis_pool_size():
+    """Every thread that can hold a connection at once: grounding fetches, admitted requests, the writer"""
+    return GROUNDING_WORKERS + sum(tier.workers + tier.queue_depth for tier in MODEL_TIERS) + 1
+
+def connect_redis():
+    global redis_client
+    if redis is None:
+        raise RuntimeError("redis package not installed")
+    pool = redis.BlockingConnectionPool(
+        host='localhost',
+        port=6379,
+        db=0,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "0")) or redis_pool_size(),
+        timeout=3,  # Wait for a free connection rather than failing
+        socket_connect_timeout=3,
+        socket_timeout=3,
+        retry_on_timeout=True
+    )
+    client = redis.Redis(connection_pool=pool)
+    client.ping()
+    redis_client = client
+    redis_writer.start()
+    logger.info(f"Redis connected (pool of {pool.max_connections})")
 
 CACHE_TTL = 60 * 60 * 24  # 24 hours
+NEGATIVE_CACHE_TTL = 60 * 5  # Failed/empty lookups are retried after 5 minutes
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+
+# Per-source TTLs (seconds); anything not listed uses CACHE_TTL
+CACHE_TTLS = {
+    "drugs": 60 * 60 * 24 * 7,  # FDA labels change rarely
+    "guidelines": 60 * 60 * 24,
+    "research": 60 * 60 * 6,  # Search results churn
+    "general": 60 * 60 * 24,
+    "dict": 60 * 60 * 24 * 30,
+    "medlineplus": 60 * 60 * 24
+}
 
 # Medical Knowledge Hub - Lightweight Access System
 MEDICAL_KNOWLEDGE_HUB = {
@@ -84,9 +776,163 @@ MEDICAL_KNOWLEDGE_HUB = {
     "research": "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&term=",
     "general": "https://medlineplus.gov/api/v2/page?query="
 }
+MEDLINEPLUS_SITE = "https://medlineplus.gov"
+DICTIONARY_API = "https://api.dictionaryapi.dev/api/v2/entries/en/"
+
+# Grounding fan-out: every upstream fetch for a request runs in parallel and
+# whatever has finished by the deadline is used
+KNOWLEDGE_PRIORITY = ["guidelines", "research", "drugs", "general"]
+GROUNDING_DEADLINE = float(os.getenv("GROUNDING_DEADLINE", "3.0"))  # seconds
+GROUNDING_WORKERS = int(os.getenv("GROUNDING_WORKERS", "16"))
+grounding_executor = ThreadPoolExecutor(
+    max_workers=GROUNDING_WORKERS,
+    thread_name_prefix="grounding"
+)
+
+# Per-upstream health: rolling outcomes feed a circuit breaker per source
+GROUNDING_SOURCES = KNOWLEDGE_PRIORITY + ["medlineplus", "dictionary"]
+SOURCE_WINDOW = 20  # Calls kept per source
+SOURCE_MIN_CALLS = 5  # Calls needed before the error rate can open the breaker
+SOURCE_ERROR_THRESHOLD = float(os.getenv("SOURCE_ERROR_THRESHOLD", "0.5"))
+SOURCE_SLOW_SECONDS = float(os.getenv("SOURCE_SLOW_SECONDS", "2.0"))  # Slower calls count as failures
+SOURCE_OPEN_SECONDS = float(os.getenv("SOURCE_OPEN_SECONDS", "30"))
+SOURCE_RATE_LIMIT_SECONDS = float(os.getenv("SOURCE_RATE_LIMIT_SECONDS", "60"))  # When 429 has no Retry-After
+SOURCE_MAX_COOLDOWN = 600
+
+class SourceUnavailable(Exception):
+    """Raised instead of calling an upstream whose breaker is open or cooling down"""
+
+    def __init__(self, source: str):
+        super().__init__(f"Source {source} skipped: breaker open")
+        self.source = source
+
+class SourceHealth:
+    """Rolling latency and error rate of one upstream, plus its circuit breaker.
+
+    closed: calls go through. open: calls are skipped until the cool-down
+    ends, then one probe call is let through (half_open) and its outcome
+    closes or reopens the breaker. rate_limited: like open, for as long as
+    the upstream's 429 Retry-After asked.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.window = deque(maxlen=SOURCE_WINDOW)  # (ok, latency)
+        self.state = "closed"
+        self.open_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "skipped": 0, "opened": 0, "rate_limited": 0}
+
+    def allow(self):
+        """"call", "probe" (the one half-open trial) or None when the source is skipped"""
+        with self.lock:
+            if self.state == "closed":
+                return "call"
+            if time.monotonic() >= self.open_until and not self.probing:
+                self.state = "half_open"
+                self.probing = True
+                return "probe"
+            self.stats["skipped"] += 1
+        SOURCE_SKIPPED.inc(source=self.name)
+        return None
+
+    def _open(self, seconds, state="open"):
+        self.state = state
+        self.open_until = time.monotonic() + seconds
+        self.probing = False
+        self.stats["opened"] += 1
+        logger.warning(f"Source {self.name} {state} for {seconds:.0f}s")
+
+    def _error_rate(self):
+        return sum(1 for ok, _ in self.window if not ok) / len(self.window) if self.window else 0.0
+
+    def record(self, ok, latency, probe=False):
+        ok = ok and latency < SOURCE_SLOW_SECONDS
+        with self.lock:
+            self.stats["calls"] += 1
+            self.stats["errors"] += 0 if ok else 1
+            if probe:
+                if ok:
+                    self.state = "closed"
+                    self.window.clear()
+                else:
+                    self._open(SOURCE_OPEN_SECONDS)
+            self.window.append((ok, latency))
+            if (self.state == "closed" and len(self.window) >= SOURCE_MIN_CALLS
+                    and self._error_rate() >= SOURCE_ERROR_THRESHOLD):
+                self._open(SOURCE_OPEN_SECONDS)
+
+    def rate_limited(self, retry_after):
+        with self.lock:
+            self.stats["rate_limited"] += 1
+            self._open(retry_after, "rate_limited")
 
-# Knowledge Snippet Cache
-knowledge_cache = {}
+    def expected_latency(self):
+        """Mean latency of the recent calls; untried sources count as instant"""
+        with self.lock:
+            return sum(latency for _, latency in self.window) / len(self.window) if self.window else 0.0
+
+    def snapshot_stats(self):
+        latency = self.expected_latency()
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update(
+                state=self.state,
+                breaker_open=0 if self.state == "closed" else 1,
+                error_rate=round(self._error_rate(), 3),
+                avg_latency_ms=round(latency * 1000, 1),
+                open_for_s=round(max(0.0, self.open_until - time.monotonic()), 1) if self.state != "closed" else 0.0
+            )
+        return stats
+
+source_health = {name: SourceHealth(name) for name in GROUNDING_SOURCES}
+
+def rank_sources(names):
+    """Fastest observed sources first (ties keep the given order)"""
+    return sorted(names, key=lambda name: source_health[name].expected_latency())
+
+def retry_after_seconds(resp):
+    try:
+        return min(float(resp.headers.get("Retry-After", "")), SOURCE_MAX_COOLDOWN)
+    except ValueError:
+        return SOURCE_RATE_LIMIT_SECONDS  # Missing, or an HTTP date
+
+def source_get(source, url, timeout, **kwargs):
+    """requests.get through the source's breaker, recording latency and outcome"""
+    health = source_health[source]
+    admission = health.allow()
+    if admission is None:
+        raise SourceUnavailable(source)
+    probe = admission == "probe"
+    start = time.monotonic()
+    try:
+        resp = requests.get(url, timeout=timeout, **kwargs)
+    except Exception:
+        health.record(False, time.monotonic() - start, probe)
+        raise
+    if resp.status_code == 429:
+        health.rate_limited(retry_after_seconds(resp))
+    else:
+        health.record(resp.status_code < 500, time.monotonic() - start, probe)
+    return resp
+
+# Offline index over the bundled DSM-5 / medication / fallback data (see local_index.py)
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", local_index.DEFAULT_INDEX_PATH)
+LOCAL_INDEX_MIN_SCORE = float(os.getenv("LOCAL_INDEX_MIN_SCORE", "2.0"))
+LOCAL_INDEX_MIN_COVERAGE = 0.8  # Share of the query's IDF mass a hit must match
+LOCAL_INDEX_MIN_KEY_COVERAGE = 0.25  # ...and match on its title, synonyms or indications, not only in passing
+LOCAL_INDEX_SUFFICIENT = 2  # Distinct title/indication matches at which the network sources are skipped
+OFFLINE_MODE = os.getenv("OFFLINE_MODE", "0") == "1"  # Never call upstream APIs
+local_knowledge = None
+
+def load_local_knowledge():
+    global local_knowledge
+    index = local_index.load_or_build(LOCAL_INDEX_PATH)
+    if index is None:
+        raise RuntimeError(f"Could not load {LOCAL_INDEX_PATH}")
+    local_knowledge = index
+    logger.info(f"Local knowledge index mapped: {len(local_knowledge)} docs")
 
 # Medical shorthand mapping
 MEDICAL_SHORTHAND = {
@@ -108,6 +954,49 @@ MEDICAL_ACRONYMS = {
     "gerd": "gastroesophageal reflux disease", "ibd": "inflammatory bowel disease"
 }
 
+# Precompiled clinical term matchers
+def trie_pattern(words) -> str:
+    """Build a regex alternation from a character trie so shared prefixes are matched once"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+    
+    def walk(node):
+        end = "" in node
+        branches = [re.escape(ch) + walk(child) for ch, child in sorted(node.items()) if ch != ""]
+        if not branches:
+            return ""
+        if len(branches) == 1 and not end:
+            return branches[0]
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if end else group
+    
+    return walk(trie)
+
+def compile_term_matcher(terms):
+    """Case-insensitive whole-word matcher for a set of terms"""
+    terms = sorted({t.lower() for t in terms if t})
+    if not terms:
+        return None
+    return re.compile(r"\b(?:" + trie_pattern(terms) + r")\b", re.IGNORECASE)
+
+clinical_term_matcher = None  # Expanded names from MEDICAL_SHORTHAND / MEDICAL_ACRONYMS
+acronym_matcher = None  # Keys of MEDICAL_ACRONYMS
+
+def refresh_term_matchers():
+    """Rebuild the matchers; call after editing MEDICAL_SHORTHAND or MEDICAL_ACRONYMS"""
+    global clinical_term_matcher, acronym_matcher
+    clinical_term_matcher = compile_term_matcher(list(MEDICAL_SHORTHAND.values()) + list(MEDICAL_ACRONYMS.values()))
+    acronym_matcher = compile_term_matcher(MEDICAL_ACRONYMS.keys())
+
+refresh_term_matchers()
+
+NON_PRINTABLE = re.compile(r'[^\x20-\x7E]')
+WHITESPACE_RUN = re.compile(r'\s+')
+
 # Enhanced safe content handling
 def safe_content(text, max_len=120):
     """Ensure clean, truncated string output with clinical context preservation"""
@@ -115,59 +1004,263 @@ def safe_content(text, max_len=120):
         return ""
     
     # Remove control chars but keep clinical symbols
-    clean = re.sub(r'[^\x20-\x7E]', '', text)  # Keep printable ASCII
+    clean = NON_PRINTABLE.sub('', text)  # Keep printable ASCII
     
     # Collapse whitespace
-    clean = re.sub(r'\s+', ' ', clean).strip()
-    
-    # Preserve clinical context in truncation
-    clinical_terms = '|'.join(list(MEDICAL_SHORTHAND.values()) + list(MEDICAL_ACRONYMS.values()))
-    if re.search(clinical_terms, clean, re.IGNORECASE):
-        matches = list(re.finditer(clinical_terms, clean, re.IGNORECASE))
-        if matches:
-            # Focus on first clinical term found
-            start_idx = max(0, matches[0].start() - 20)
-            end_idx = min(len(clean), matches[0].end() + 20)
-            clean = clean[start_idx:end_idx]
+    clean = WHITESPACE_RUN.sub(' ', clean).strip()
+    
+    # Preserve clinical context in truncation: focus on first clinical term found
+    match = clinical_term_matcher.search(clean) if clinical_term_matcher else None
+    if match:
+        start_idx = max(0, match.start() - 20)
+        end_idx = min(len(clean), match.end() + 20)
+        clean = clean[start_idx:end_idx]
     
     if len(clean) > max_len:
         return clean[:max_len] + '...'
     return clean
 
+# Two-tier knowledge cache: bounded in-process LRU in front of Redis
+def is_negative_result(result):
+    """Empty strings, None and (None, None) pairs count as failed lookups"""
+    if isinstance(result, (tuple, list)):
+        return not any(result)
+    return not result
+
+def sanitize_result(result):
+    """Apply safe_content to cacheable results"""
+    if isinstance(result, tuple) and len(result) == 2:
+        return (safe_content(result[0]), result[1])
+    elif isinstance(result, list):
+        return [safe_content(item) if isinstance(item, str) else item for item in result]
+    elif isinstance(result, str):
+        return safe_content(result)
+    return result
+
+class KnowledgeCache:
+    """Size-bounded LRU with per-entry TTL, backed by Redis when available.
+
+    Failed lookups are stored as negative entries with NEGATIVE_CACHE_TTL so a
+    dead upstream is not hit again on every request.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = ttls or {}
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.absent = {}  # key -> expires_at: recently confirmed missing from Redis
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0, "redis_hits": 0, "misses": 0, "negative_hits": 0,
+            "evictions": 0, "expirations": 0, "mget_calls": 0, "prefetched": 0
+        }
+
+    def ttl_for(self, namespace, negative=False):
+        if negative:
+            return NEGATIVE_CACHE_TTL
+        return self.ttls.get(namespace, CACHE_TTL)
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def get_local(self, key):
+        """Return (found, value) from the in-process tier"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                self.stats["expirations"] += 1
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def set_local(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def known_absent(self, key):
+        """True if a prefetch just found the key missing from Redis"""
+        with self.lock:
+            expires_at = self.absent.get(key)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self.absent[key]
+                return False
+            return True
+
+    def prefetch(self, items):
+        """Load every (namespace, key) missing locally from Redis in one MGET"""
+        if not redis_client:
+            return 0
+        missing = list(dict.fromkeys((ns, key) for ns, key in items if not self.get_local(key)[0]))
+        if not missing:
+            return 0
+        try:
+            raws = redis_client.mget([f"cache:{key}" for _, key in missing])
+        except Exception as e:
+            logger.warning(f"Cache prefetch failed: {e}")
+            return 0
+        
+        found = 0
+        absent_until = time.monotonic() + GROUNDING_DEADLINE
+        for (namespace, key), raw in zip(missing, raws):
+            if raw is None:
+                with self.lock:
+                    self.absent[key] = absent_until
+                continue
+            try:
+                value = decode_cache_value(raw)
+            except Exception:
+                continue
+            self.set_local(key, value, self.ttl_for(namespace, is_negative_result(value)))
+            found += 1
+        with self.lock:
+            self.stats["mget_calls"] += 1
+            self.stats["prefetched"] += found
+            if len(self.absent) > self.max_entries:
+                now = time.monotonic()
+                self.absent = {k: t for k, t in self.absent.items() if t > now}
+        return found
+
+    def get(self, namespace, key):
+        """Return (found, value) checking memory first, then Redis"""
+        found, value = self.get_local(key)
+        if found:
+            self._count("negative_hits" if is_negative_result(value) else "hits")
+            return True, value
+        
+        if redis_client and not self.known_absent(key):
+            try:
+                cached = redis_client.get(f"cache:{key}")
+                if cached is not None:
+                    value = decode_cache_value(cached)
+                    negative = is_negative_result(value)
+                    self.set_local(key, value, self.ttl_for(namespace, negative))
+                    self._count("negative_hits" if negative else "redis_hits")
+                    return True, value
+            except Exception as e:
+                logger.warning(f"Cache lookup failed: {e}")
+        
+        self._count("misses")
+        return False, None
+
+    def set(self, namespace, key, value):
+        ttl = self.ttl_for(namespace, is_negative_result(value))
+        self.set_local(key, value, ttl)
+        if redis_client:
+            with self.lock:
+                self.absent.pop(key, None)
+            redis_writer.put(f"cache:{key}", ttl, value)  # Written off the request path
+
+    def export_entries(self):
+        """Unexpired positive entries as (key, value, remaining_ttl)"""
+        now = time.monotonic()
+        with self.lock:
+            return [
+                (key, value, expires_at - now)
+                for key, (expires_at, value) in self.entries.items()
+                if expires_at > now and not is_negative_result(value)
+            ]
+
+    def snapshot_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["redis_hits"] + stats["negative_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+knowledge_cache = KnowledgeCache(ttls=CACHE_TTLS)
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution and its result (or exception)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.in_flight = {}  # key -> Future
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, func, *args, **kwargs):
+        """Return (result, shared); shared is True when another caller did the work"""
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+            self.stats["leaders" if leader else "coalesced"] += 1
+        SINGLE_FLIGHT.inc(flight=self.name, role="leader" if leader else "coalesced")
+        if not leader:
+            return future.result(), True
+        
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def snapshot_stats(self):
+        with self.lock:
+            return dict(self.stats, in_flight=len(self.in_flight))
+
+upstream_flight = SingleFlight("upstream")
+
+def lookup_key(namespace, args) -> str:
+    """Namespaced key for a lookup; the arguments are hashed with 16-byte BLAKE2b"""
+    return f"{namespace}:{hashlib.blake2b(repr(args).encode('utf-8'), digest_size=16).hexdigest()}"
+
 # Cache function with safe content
 def cache_lookup(key, fetch_func, *args, **kwargs):
-    if not redis_client:
-        return fetch_func(*args, **kwargs)
+    cache_key = lookup_key(key, args)
+    found, cached = knowledge_cache.get(key, cache_key)
+    if found:
+        return cached
     
-    cache_key = f"cache:{key}:{hashlib.sha256(json.dumps(args, sort_keys=True).encode()).hexdigest()}"
-    try:
-        cached = redis_client.get(cache_key)
-        if cached:
-            return json.loads(cached)
-    except Exception as e:
-        logger.warning(f"Cache lookup failed: {e}")
-    
-    result = fetch_func(*args, **kwargs)
-    
-    try:
-        # Apply safety before caching
-        if isinstance(result, tuple) and len(result) == 2:
-            result = (safe_content(result[0]), result[1])
-        elif isinstance(result, list):
-            result = [safe_content(item) if isinstance(item, str) else item for item in result]
-        elif isinstance(result, str):
-            result = safe_content(result)
+    def fetch():
+        # A leader that finished just before we got here may have filled the cache
+        found, cached = knowledge_cache.get_local(cache_key)
+        if found:
+            return cached
         
-        redis_client.setex(cache_key, CACHE_TTL, json.dumps(result))
-    except Exception as e:
-        logger.warning(f"Cache set failed: {e}")
+        start = time.monotonic()
+        try:
+            result = fetch_func(*args, **kwargs)
+        except SourceUnavailable:
+            raise  # Skipped, not answered: nothing to time or cache
+        except Exception:
+            UPSTREAM_SECONDS.observe(time.monotonic() - start, source=key)
+            knowledge_cache.set(key, cache_key, None)
+            raise
+        UPSTREAM_SECONDS.observe(time.monotonic() - start, source=key)
+        
+        # Apply safety before caching
+        result = sanitize_result(result)
+        knowledge_cache.set(key, cache_key, result)
+        return result
     
-    return result
+    # Concurrent misses for the same key wait on one upstream call
+    return upstream_flight.do(cache_key, fetch)[0]
 
 # Request model with validation
 class ChatRequest(BaseModel):
     message: str = Field(..., min_length=1, max_length=300)
     history: list = Field(default=[], max_items=5)
+    session_id: Optional[str] = Field(default=None, pattern=r"^[0-9a-f]{32}$")  # Issued by POST /session
 
 # Robust minimal input handler
 def handle_minimal_input(user_input: str) -> tuple[str, list]:
@@ -195,44 +1288,93 @@ def handle_minimal_input(user_input: str) -> tuple[str, list]:
     return user_input, []
 
 # Enhanced key term extraction
-def extract_key_terms(text):
+def key_terms_from_doc(doc, text):
+    terms = {}  # Ordered set: the same query always keeps the same 5 terms
+    
+    # Extract noun chunks and entities
+    for chunk in doc.noun_chunks:
+        if 3 < len(chunk.text) < 50:  # Reasonable length constraint
+            terms[chunk.text.lower()] = None
+    
+    for ent in doc.ents:
+        if ent.label_ in ["DISEASE", "SYMPTOM", "DRUG", "ORG"] and 3 < len(ent.text) < 50:
+            terms[ent.text.lower()] = None
+    
+    # Add clinical abbreviations
+    if acronym_matcher:
+        for match in acronym_matcher.finditer(text):
+            terms[match.group().lower()] = None
+    
+    return list(terms)[:5]  # Return top 5 terms, in document order
+
+def extract_key_terms(text, doc=None):
     if not isinstance(text, str) or not text.strip():
         return []
     
     try:
-        doc = nlp(text)
-        terms = set()
-        
-        # Extract noun chunks and entities
-        for chunk in doc.noun_chunks:
-            if 3 < len(chunk.text) < 50:  # Reasonable length constraint
-                terms.add(chunk.text.lower())
-        
-        for ent in doc.ents:
-            if ent.label_ in ["DISEASE", "SYMPTOM", "DRUG", "ORG"] and 3 < len(ent.text) < 50:
-                terms.add(ent.text.lower())
-        
-        # Add clinical abbreviations
-        abbrevs = re.findall(r'\b[a-zA-Z]{2,4}\b', text)
-        for abbr in abbrevs:
-            if abbr.lower() in MEDICAL_ACRONYMS:
-                terms.add(abbr.lower())
-        
-        return list(terms)[:5]  # Return top 5 terms
+        if doc is None:
+            doc = nlp(text, disable=KEY_TERM_DISABLE)
+        return key_terms_from_doc(doc, text)
     except Exception as e:
         logger.error(f"Term extraction error: {e}")
         return []
 
+def extract_key_terms_batch(texts: list) -> list:
+    """extract_key_terms for many texts through one nlp.pipe pass"""
+    texts = [t if isinstance(t, str) else "" for t in texts]
+    try:
+        docs = nlp.pipe(texts, disable=KEY_TERM_DISABLE)
+        return [key_terms_from_doc(doc, text) if text.strip() else [] for doc, text in zip(docs, texts)]
+    except Exception as e:
+        logger.error(f"Term extraction error: {e}")
+        return [[] for _ in texts]
+
+class QueryAnalysis:
+    """Per-request NLP state: the input is parsed once and shared by every stage"""
+
+    def __init__(self, text: str, doc=None):
+        self.text = text
+        self.doc = doc
+        with stage("extract_key_terms"):
+            if doc is None and isinstance(text, str) and text.strip():
+                try:
+                    self.doc = nlp(text, disable=KEY_TERM_DISABLE)
+                except Exception as e:
+                    logger.error(f"Term extraction error: {e}")
+            self.terms = key_terms_from_doc(self.doc, text) if self.doc is not None else []
+        self._expanded_terms = None
+
+    @classmethod
+    def batch(cls, texts: list) -> list:
+        """Analyses for many inputs: one nlp.pipe pass for the inputs and one for all of their terms"""
+        docs = [None] * len(texts)
+        try:
+            docs = list(nlp.pipe(texts, disable=KEY_TERM_DISABLE))
+        except Exception as e:
+            logger.error(f"Term extraction error: {e}")
+        analyses = [cls(text, doc if text.strip() else None) for text, doc in zip(texts, docs)]
+        
+        unique_terms = sorted({term for analysis in analyses for term in analysis.terms})
+        try:
+            term_docs = dict(zip(unique_terms, nlp.pipe(unique_terms, disable=EXPANSION_DISABLE)))
+            for analysis in analyses:
+                analysis._expanded_terms = expanded_from_docs(analysis.terms, [term_docs[t] for t in analysis.terms])
+        except Exception as e:
+            logger.error(f"Term expansion error: {e}")  # Falls back to per-query expansion
+        return analyses
+
+    @property
+    def expanded_terms(self) -> list:
+        if self._expanded_terms is None:
+            with stage("expand_terms"):
+                self._expanded_terms = expand_medical_terms(self.terms) if self.terms else []
+        return self._expanded_terms
+
 # Medical Knowledge Access Functions
-def fetch_medical_snippet(topic: str, source_type: str = "general") -> str:
-    """Retrieve concise medical knowledge snippet"""
-    cache_key = f"{source_type}:{topic}"
-    if cache_key in knowledge_cache:
-        return knowledge_cache[cache_key]
-    
+def _fetch_medical_snippet(topic: str, source_type: str = "general") -> str:
     try:
         url = MEDICAL_KNOWLEDGE_HUB[source_type] + requests.utils.quote(topic)
-        response = requests.get(url, timeout=2.5)  # Strict timeout
+        response = source_get(source_type, url, timeout=2.5)  # Strict timeout
         
         if response.status_code != 200:
             return ""
@@ -257,44 +1399,100 @@ def fetch_medical_snippet(topic: str, source_type: str = "general") -> str:
             snippet = f"PubMed ID: {id_list[0]}" if id_list else ""
         
         # Safe processing
-        clean_snippet = safe_content(snippet, 100) if snippet else ""
-        knowledge_cache[cache_key] = clean_snippet
-        return clean_snippet
+        return safe_content(snippet, 100) if snippet else ""
+    except SourceUnavailable:
+        raise
     except Exception as e:
         logger.warning(f"Knowledge fetch failed: {e}")
         return ""
 
+def fetch_medical_snippet(topic: str, source_type: str = "general") -> str:
+    """Retrieve concise medical knowledge snippet"""
+    return cache_lookup(source_type, _fetch_medical_snippet, topic, source_type)
+
 def expand_medical_terms(terms: list) -> list:
     """Expand terms to related medical concepts"""
-    expanded = set(terms)
-    for term in terms:
-        doc = nlp(term)
+    return expanded_from_docs(terms, nlp.pipe(terms, disable=EXPANSION_DISABLE))
+
+def expanded_from_docs(terms: list, docs) -> list:
+    """expand_medical_terms over already parsed term docs"""
+    expanded = dict.fromkeys(terms)  # Ordered set: the original terms first, then additions in document order
+    for doc in docs:
         for token in doc:
             # Expand with hypernyms (broader categories)
             if token.dep_ == "ROOT":
-                expanded.add(token.lemma_)
+                expanded[token.lemma_] = None
                 for ancestor in token.ancestors:
-                    expanded.add(ancestor.lemma_)
+                    expanded[ancestor.lemma_] = None
             
             # Expand with hyponyms (specific subtypes)
             for child in token.children:
                 if child.dep_ in ("dobj", "nsubj", "attr"):
-                    expanded.add(child.lemma_)
+                    expanded[child.lemma_] = None
     return list(expanded)[:5]  # Keep manageable
 
-def fuse_medical_knowledge(user_input: str) -> str:
-    """Combine multiple knowledge sources into concise insight"""
-    terms = extract_key_terms(user_input)
-    if not terms:
-        return ""
-    
-    expanded_terms = expand_medical_terms(terms)
-    
+def gather_until(futures: dict, deadline: float, cancel: bool = True) -> dict:
+    """Wait for futures until the deadline and return the finished results by key.
+
+    Stops early, cancelling what has not started, if the client disconnects.
+    """
+    pending = set(futures.values())
+    while pending and not is_cancelled():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        _, pending = wait(pending, timeout=min(remaining, CANCEL_POLL_INTERVAL))
+    results = {}
+    for key, future in futures.items():
+        if not future.done():
+            if cancel:
+                future.cancel()  # Late fetches still land in the cache if already running
+            continue
+        try:
+            results[key] = future.result()
+        except SourceUnavailable:
+            pass  # Counted in sawa_source_skipped_total
+        except Exception as e:
+            logger.warning(f"Grounding fetch {key} failed: {e}")
+    check_cancelled("grounding")
+    if len(results) < len(futures):
+        logger.info(f"Grounding deadline hit: {len(results)}/{len(futures)} fetches ready")
+    return results
+
+class SharedFetches:
+    """Upstream fetches shared by the requests of a batch: each (function, args) runs once"""
+
+    def __init__(self):
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.shared = 0
+
+    def submit(self, fetch_func, *args):
+        key = (fetch_func, args)
+        with self.lock:
+            future = self.futures.get(key)
+            if future is None:
+                future = self.futures[key] = grounding_executor.submit(fetch_func, *args)
+            else:
+                self.shared += 1
+        return future
+
+def submit_knowledge_fetches(expanded_terms: list, submit=None, sources=None) -> dict:
+    """Start one fetch per (source, term) pair on the grounding pool, fastest sources first"""
+    submit = submit or grounding_executor.submit
+    return {
+        (source, term): submit(fetch_medical_snippet, term, source)
+        for source in (sources or rank_sources(KNOWLEDGE_PRIORITY))
+        for term in expanded_terms
+    }
+
+def select_knowledge(results: dict, expanded_terms: list, terms: list) -> str:
+    """Pick the most relevant snippet from the fetches that arrived in time"""
     # Priority: Guidelines > Research > Drugs > General
     knowledge_snippets = []
-    for source in ["guidelines", "research", "drugs", "general"]:
+    for source in KNOWLEDGE_PRIORITY:
         for term in expanded_terms:
-            snippet = fetch_medical_snippet(term, source)
+            snippet = results.get((source, term))
             if snippet and len(snippet) > 10:
                 knowledge_snippets.append(snippet)
             if len(knowledge_snippets) >= 3:  # Don't collect too many
@@ -305,18 +1503,29 @@ def fuse_medical_knowledge(user_input: str) -> str:
     if not knowledge_snippets:
         return ""
     
-    # Select most relevant snippet
-    return heapq.nlargest(
-        1, 
-        knowledge_snippets, 
-        key=lambda s: len(set(extract_key_terms(s)) & set(terms))
-    )[0]
+    # Select most relevant snippet (all candidates parsed in one batch)
+    overlap = {
+        snippet: len(set(snippet_terms) & set(terms))
+        for snippet, snippet_terms in zip(knowledge_snippets, extract_key_terms_batch(knowledge_snippets))
+    }
+    return heapq.nlargest(1, knowledge_snippets, key=overlap.get)[0]
+
+def fuse_medical_knowledge(user_input: str, deadline: float = None, analysis: QueryAnalysis = None) -> str:
+    """Combine multiple knowledge sources into concise insight"""
+    analysis = analysis or QueryAnalysis(user_input)
+    if not analysis.terms:
+        return ""
+    
+    if deadline is None:
+        deadline = time.monotonic() + GROUNDING_DEADLINE
+    results = gather_until(submit_knowledge_fetches(analysis.expanded_terms), deadline)
+    return select_knowledge(results, analysis.expanded_terms, analysis.terms)
 
 # API functions with enhanced error handling
 def _lookup_dictionary(term):
     try:
-        url = f"https://api.dictionaryapi.dev/api/v2/entries/en/{term}"
-        response = requests.get(url, timeout=3)  # Reduced timeout
+        url = f"{DICTIONARY_API}{term}"
+        response = source_get("dictionary", url, timeout=3)  # Reduced timeout
         response.raise_for_status()
         
         # Handle rate limiting
@@ -331,6 +1540,8 @@ def _lookup_dictionary(term):
                     if definition.get("definition"):
                         return definition["definition"]
         return None
+    except SourceUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Dictionary lookup error: {e}")
         return None
@@ -338,39 +1549,142 @@ def _lookup_dictionary(term):
 def lookup_dictionary(term):
     return cache_lookup("dict", _lookup_dictionary, term)
 
+# MedlinePlus pages are streamed into small incremental parsers that keep only
+# the element they need and stop reading once it is found
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(512 * 1024)))  # Per page
+SCRAPE_CHUNK_BYTES = 16 * 1024
+SCRAPE_TEXT_LIMIT = 4000  # Characters of article text kept when no clinical term shows up
+
+class TargetedHTMLParser(HTMLParser):
+    """Incremental parser that sets `done` once it has what it needs"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+
+class ResultLinkParser(TargetedHTMLParser):
+    """First a.results-link href on a search page"""
+
+    def __init__(self):
+        super().__init__()
+        self.href = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done or tag != "a":
+            return
+        attrs = dict(attrs)
+        if "results-link" in (attrs.get("class") or "").split() and attrs.get("href"):
+            self.href = attrs["href"]
+            self.done = True
+
+    def handle_data(self, data):
+        if "No results found" in data:
+            self.done = True
+
+class MainContentParser(TargetedHTMLParser):
+    """Text of div#main-content (or div.main-content) without script, style and footer.
+
+    Text nodes are joined with spaces like BeautifulSoup's get_text(" ", strip=True).
+    Parsing stops at the end of the div or as soon as `enough(text)` is true.
+    """
+    SKIP = {"script", "style", "footer"}
+
+    def __init__(self, enough=None):
+        super().__init__()
+        self.enough = enough
+        self.depth = 0  # div nesting inside the content div; 0 means outside
+        self.found = False
+        self.skipping = 0
+        self.pending = []
+        self.texts = []
+
+    def text(self) -> str:
+        return " ".join(self.texts)
+
+    def flush(self):
+        piece = "".join(self.pending).strip()
+        self.pending = []
+        if piece:
+            self.texts.append(piece)
+            if self.enough and self.enough(self.text()):
+                self.done = True
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if self.done:
+            return
+        if not self.depth:
+            attrs = dict(attrs)
+            if tag == "div" and not self.found and (
+                attrs.get("id") == "main-content" or "main-content" in (attrs.get("class") or "").split()
+            ):
+                self.depth = 1
+                self.found = True
+            return
+        if tag == "div":
+            self.depth += 1
+        if tag in self.SKIP:
+            self.skipping += 1
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if self.done or not self.depth:
+            return
+        if tag in self.SKIP and self.skipping:
+            self.skipping -= 1
+        elif tag == "div":
+            self.depth -= 1
+            self.done = not self.depth
+
+    def handle_data(self, data):
+        if self.depth and not self.skipping and not self.done:
+            self.pending.append(data)
+
+def feed_html(parser, chunks, encoding="utf-8", max_bytes=SCRAPE_MAX_BYTES):
+    """Decode and feed byte chunks until the parser is done or max_bytes were read"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    received = 0
+    for chunk in chunks:
+        received += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done or received >= max_bytes:
+            break
+    if isinstance(parser, MainContentParser):
+        parser.flush()
+    return parser
+
+def stream_html(url, parser, source="medlineplus"):
+    """GET a page and stream it into the parser, closing the connection early once done"""
+    with source_get(source, url, timeout=5, stream=True) as resp:
+        resp.raise_for_status()
+        return feed_html(parser, resp.iter_content(SCRAPE_CHUNK_BYTES), resp.encoding or "utf-8")
+
+def scraped_text_sufficient(text: str) -> bool:
+    """True once more article text can no longer change what safe_content keeps"""
+    clean = WHITESPACE_RUN.sub(' ', NON_PRINTABLE.sub('', text)).strip()
+    match = clinical_term_matcher.search(clean) if clinical_term_matcher else None
+    if match:
+        return len(clean) >= match.end() + 20
+    return len(clean) >= SCRAPE_TEXT_LIMIT
+
 def _scrape_trusted_health_site(query):
     try:
-        search_url = f"https://medlineplus.gov/search/?query={requests.utils.quote(query)}"
-        resp = requests.get(search_url, timeout=5)  # Reduced timeout
-        resp.raise_for_status()
-        
-        # Check for empty results
-        if "No results found" in resp.text:
-            return None, None
-            
-        soup = BeautifulSoup(resp.text, "html.parser")
-        link = soup.find("a", class_="results-link")
-        if link and link.get("href"):
-            page_url = "https://medlineplus.gov" + link.get("href")
+        search_url = f"{MEDLINEPLUS_SITE}/search/?query={requests.utils.quote(query)}"
+        link = stream_html(search_url, ResultLinkParser()).href
+        if link:
+            page_url = MEDLINEPLUS_SITE + link
             
             # Skip PDF links
             if page_url.endswith(".pdf"):
                 return None, None
-                
-            page = requests.get(page_url, timeout=5)
-            page.raise_for_status()
-            page_soup = BeautifulSoup(page.text, "html.parser")
             
             # Focus on main content
-            content_div = page_soup.find("div", id="main-content") or page_soup.find("div", class_="main-content")
-            if content_div:
-                # Remove non-content elements
-                for elem in content_div.find_all(["script", "style", "footer"]):
-                    elem.decompose()
-                    
-                text = content_div.get_text(separator=" ", strip=True)
-                return text, page_url
+            content = stream_html(page_url, MainContentParser(scraped_text_sufficient))
+            if content.found:
+                return content.text(), page_url
         return None, None
+    except SourceUnavailable:
+        raise
     except Exception as e:
         logger.error(f"MedlinePlus error: {e}")
         return None, None
@@ -378,12 +1692,74 @@ def _scrape_trusted_health_site(query):
 def scrape_trusted_health_site(query):
     return cache_lookup("medlineplus", _scrape_trusted_health_site, query)
 
+def search_local_knowledge(user_input):
+    """(sources, anchored): bundled-index hits good enough to ground on, and how many
+    distinct documents matched the query on their title or indication fields"""
+    if not local_knowledge:
+        return [], 0
+    try:
+        hits = local_knowledge.search(user_input, k=3)
+    except Exception as e:
+        logger.warning(f"Local knowledge search failed: {e}")
+        return [], 0
+    hits = [
+        hit for hit in hits
+        if hit["score"] >= LOCAL_INDEX_MIN_SCORE and hit["coverage"] >= LOCAL_INDEX_MIN_COVERAGE
+        and hit["key_coverage"] >= LOCAL_INDEX_MIN_KEY_COVERAGE
+    ]
+    anchored = len({hit["title"].lower() for hit in hits if hit["key_coverage"] >= LOCAL_INDEX_MIN_COVERAGE})
+    sources = [{"desc": hit["source"], "content": safe_content(hit["content"], 100), "url": None} for hit in hits]
+    return sources, anchored
+
+def grounding_cache_keys(user_input, terms, expanded_terms):
+    """(namespace, key) of every cache_lookup build_grounding makes for these terms"""
+    keys = [
+        (source, lookup_key(source, (term, source)))
+        for source in KNOWLEDGE_PRIORITY
+        for term in expanded_terms
+    ]
+    keys.append(("medlineplus", lookup_key("medlineplus", (user_input,))))
+    if terms:
+        keys.append(("dict", lookup_key("dict", (terms[0],))))
+    return keys
+
 # Enhanced grounding with clinical prioritization
-def build_grounding(user_input):
-    sources = []
+def build_grounding(user_input, deadline=None, analysis=None, fetches=None):
+    # 0. Bundled offline index (microseconds); the network only fills gaps
+    with stage("local_index"):
+        sources, anchored = search_local_knowledge(user_input)
+    if OFFLINE_MODE or anchored >= LOCAL_INDEX_SUFFICIENT:
+        return sources[:3]
+    
+    if deadline is None:
+        deadline = time.monotonic() + GROUNDING_DEADLINE
+    analysis = analysis or QueryAnalysis(user_input)
+    terms = analysis.terms
+    expanded_terms = analysis.expanded_terms
+    
+    # One Redis MGET for every cached lookup the fan-out below can make
+    with stage("cache_prefetch"):
+        knowledge_cache.prefetch(grounding_cache_keys(user_input, terms, expanded_terms))
+    
+    # Fan out every upstream call at once under a single deadline, fastest sources
+    # first so slow ones are the ones left queued when the pool is busy
+    submit = fetches.submit if fetches else grounding_executor.submit
+    futures = {}
+    for source in rank_sources(GROUNDING_SOURCES):
+        if source == "medlineplus":
+            futures["medlineplus"] = submit(scrape_trusted_health_site, user_input)
+        elif source == "dictionary":
+            if terms:
+                futures["dictionary"] = submit(lookup_dictionary, terms[0])
+        else:
+            futures.update(submit_knowledge_fetches(expanded_terms, submit, [source]))
+    with stage("grounding_fetch"):
+        # Shared fetches may still be wanted by another request of the batch
+        results = gather_until(futures, deadline, cancel=fetches is None)
     
     # 1. Fused knowledge snippet (multi-source)
-    fused_knowledge = fuse_medical_knowledge(user_input)
+    with stage("rank_snippets"):
+        fused_knowledge = select_knowledge(results, expanded_terms, terms)
     if fused_knowledge:
         sources.append({
             "desc": "Medical Knowledge Hub",
@@ -392,54 +1768,62 @@ def build_grounding(user_input):
         })
     
     # 2. Trusted health sites
-    try:
-        content, url = scrape_trusted_health_site(user_input)
-        if content:
-            sources.append({
-                "desc": "MedlinePlus",
-                "content": safe_content(content, 100),
-                "url": url
-            })
-    except Exception as e:
-        logger.error(f"MedlinePlus error: {e}")
+    content, url = results.get("medlineplus") or (None, None)
+    if content:
+        sources.append({
+            "desc": "MedlinePlus",
+            "content": safe_content(content, 100),
+            "url": url
+        })
     
     # 3. Dictionary definitions for key terms
-    terms = extract_key_terms(user_input)
-    if terms and len(sources) < 3:
-        definition = lookup_dictionary(terms[0])
-        if definition:
-            sources.append({
-                "desc": "Dictionary",
-                "content": safe_content(definition, 80),
-                "url": None
-            })
+    definition = results.get("dictionary")
+    if definition and len(sources) < 3:
+        sources.append({
+            "desc": "Dictionary",
+            "content": safe_content(definition, 80),
+            "url": None
+        })
     
     return sources[:3]  # Max 3 sources
 
 # Clinical prompt builder
+def source_segment(i, source):
+    return f"[{i}] {source['content']}\n"
+
+def history_segment(turn):
+    user_msg = turn.get('user', '')[:70]
+    ai_msg = turn.get('ai', '')[:70]
+    return f"User: {user_msg}\nAI: {ai_msg}\n"
+
+def question_segment(user_input):
+    return f"User: {user_input[:150]}\nAI:"
+
+def session_turn_segment(turn):
+    """A past session turn rendered exactly as its prompt was, followed by the reply text the model generated"""
+    sources = "".join(source_segment(i, {"content": c}) for i, c in enumerate(turn.get('sources', []), 1))
+    return sources + question_segment(turn.get('user', '')) + turn.get('ai', '') + "\n"
+
 def build_prompt(history, user_input, sources):
-    # Clinical system message
-    system = (
-        "You are a clinical expert. Provide concise, evidence-based responses.\n"
-        "Format:\n"
-        "**Summary**: 1-2 sentence clinical action\n"
-        "**Recommendations**: Step-by-step management\n"
-        "**Monitoring**: Key parameters to watch\n\n"
-        "[Relevant Knowledge]:\n"
-    )
+    # Clinical system message (stable prefix, see SYSTEM_PROMPT)
+    system = SYSTEM_PROMPT
     
     # Add sources with clinical relevance
     for i, source in enumerate(sources, 1):
-        system += f"[{i}] {source['content']}\n"
+        system += source_segment(i, source)
     
     # Clinical history context
     chat = ""
     for turn in history[-HISTORY_LIMIT:]:
-        user_msg = turn.get('user', '')[:70] 
-        ai_msg = turn.get('ai', '')[:70]
-        chat += f"User: {user_msg}\nAI: {ai_msg}\n"
+        chat += history_segment(turn)
     
-    return system + f"\nUser: {user_input[:150]}\nAI:"
+    return system + "\n" + chat + question_segment(user_input)
+
+def build_session_prompt(turns, user_input, sources):
+    """Append-only session layout: each turn keeps its sources and raw reply, so the
+    previous prompt and generation (the saved model state) are a prefix of the next"""
+    chat = "".join(session_turn_segment(turn) for turn in turns)
+    return SYSTEM_PROMPT + "\n" + chat + "".join(source_segment(i, s) for i, s in enumerate(sources, 1)) + question_segment(user_input)
 
 # Safe token counting
 def safe_token_count(prompt):
@@ -453,37 +1837,398 @@ def safe_token_count(prompt):
         logger.warning(f"Token count error: {e}")
         return len(prompt) // 4
 
+# Segments are tokenized on their own, so allow one token per segment for merges at the joins
+SEGMENT_MARGIN = 1
+
+@lru_cache(maxsize=4096)
+def segment_token_count(text):
+    """Token count of one prompt segment, cached across requests"""
+    return safe_token_count(text) + SEGMENT_MARGIN
+
 # Smart prompt trimming with clinical priority
-def prepare_prompt_and_trim(history, user_input, sources):
-    prompt = build_prompt(history, user_input, sources)
-    token_count = safe_token_count(prompt)
-    
-    # Trim strategy (preserve clinical sources)
-    while token_count > MAX_PROMPT_TOKENS:
-        # 1. Trim history first
-        if history:
-            history = history[:-1]  # Remove oldest history
-        # 2. Remove non-clinical sources
-        elif sources and len(sources) > 1:
-            non_clinical = [s for s in sources if s['desc'] in ["Dictionary", "Wikipedia"]]
-            if non_clinical:
-                sources.remove(non_clinical[0])
-            else:
-                sources.pop()  # Remove last source
-        # 3. Truncate user input
-        elif len(user_input) > 50:
-            user_input = user_input[:40] + "..."
-        # 4. Finally truncate prompt
-        else:
-            prompt = prompt[:500] + "..."
-            break
-        
-        # Rebuild and recount
-        prompt = build_prompt(history, user_input, sources)
-        token_count = safe_token_count(prompt)
+def prepare_prompt_and_trim(history, user_input, sources, max_tokens=None, session=False):
+    return trim_prompt(history, user_input, sources, max_tokens, session)[0]
+
+def trim_prompt(history, user_input, sources, max_tokens=None, session=False):
+    """Pick the history turns and sources that fit max_tokens (MAX_PROMPT_TOKENS) in one pass; (prompt, kept source texts).
+
+    Each segment is counted once (and cached); the trim order is unchanged:
+    oldest history first, then non-clinical sources, then trailing sources,
+    then the user input. Session history keeps more and longer turns.
+    """
+    max_tokens = max_tokens or MAX_PROMPT_TOKENS
+    turn_segment = session_turn_segment if session else history_segment
+    turns = list(history[-SESSION_HISTORY_LIMIT:] if session else history[-HISTORY_LIMIT:])
+    sources = list(sources)
+    
+    fixed = segment_token_count(SYSTEM_PROMPT) + segment_token_count(question_segment(user_input))
+    source_costs = [segment_token_count(source_segment(i, s)) for i, s in enumerate(sources, 1)]
+    turn_costs = [segment_token_count(turn_segment(t)) for t in turns]
+    token_count = fixed + sum(source_costs) + sum(turn_costs)
+    
+    # 1. Trim history first (oldest turn first)
+    while turns and token_count > max_tokens:
+        turns.pop(0)
+        token_count -= turn_costs.pop(0)
+    
+    # 2. Remove non-clinical sources, then trailing ones; keep at least one
+    while len(sources) > 1 and token_count > max_tokens:
+        non_clinical = [i for i, s in enumerate(sources) if s['desc'] in ["Dictionary", "Wikipedia"]]
+        idx = non_clinical[0] if non_clinical else len(sources) - 1
+        sources.pop(idx)
+        token_count -= source_costs.pop(idx)  # Renumbering "[n]" does not change the count
+    
+    # 3. Truncate user input
+    if token_count > max_tokens and len(user_input) > 50:
+        token_count -= segment_token_count(question_segment(user_input))
+        user_input = user_input[:40] + "..."
+        token_count += segment_token_count(question_segment(user_input))
     
-    logger.info(f"Final token count: {token_count}/{MAX_PROMPT_TOKENS}")
-    return prompt
+    prompt = (build_session_prompt if session else build_prompt)(turns, user_input, sources)
+    
+    # 4. Finally truncate prompt
+    if token_count > max_tokens:
+        prompt = prompt[:500] + "..."
+    
+    logger.info(f"Final token count: ~{token_count}/{max_tokens}")
+    return prompt, [source['content'] for source in sources]
+
+# Response cache for repeated and lightly rephrased questions
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(60 * 60 * 6)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+NEAR_DUPLICATE_LOOKUP = os.getenv("NEAR_DUPLICATE_LOOKUP", "0") == "1"
+NEAR_DUPLICATE_THRESHOLD = 0.85  # Minimum estimated Jaccard similarity
+MINHASH_PERMUTATIONS = 32
+MINHASH_BANDS = 8  # 4 rows per band
+MERSENNE_PRIME = (1 << 61) - 1
+MINHASH_PARAMS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % MERSENNE_PRIME | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % MERSENNE_PRIME)
+    for i in range(MINHASH_PERMUTATIONS)
+]
+
+response_cache = KnowledgeCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttls={"response": RESPONSE_CACHE_TTL})
+
+def normalize_query(user_input, terms):
+    """Lowercase, expand acronyms and append the sorted key terms"""
+    words = re.findall(r"[a-z0-9]+", user_input.lower())
+    if len(words) == 1 and words[0] in MEDICAL_SHORTHAND:
+        words = [MEDICAL_SHORTHAND[words[0]]]
+    words = [MEDICAL_ACRONYMS.get(w, w) for w in words]
+    return " ".join(words) + "|" + ",".join(sorted(terms))
+
+def response_cache_key(normalized, history, sources, session=False):
+    """Normalized query + trimmed history + grounding sources"""
+    turns = history[-SESSION_HISTORY_LIMIT:] if session else history[-HISTORY_LIMIT:]
+    context = json.dumps([
+        [(session_turn_segment if session else history_segment)(turn) for turn in turns],
+        [source['content'] for source in sources]
+    ])
+    context_hash = hashlib.sha256(context.encode()).hexdigest()[:16]
+    return f"response:{context_hash}:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+def minhash_signature(text):
+    """MinHash over character 4-gram shingles"""
+    shingles = {text[i:i + 4] for i in range(max(1, len(text) - 3))}
+    hashes = [int.from_bytes(hashlib.blake2b(sh.encode(), digest_size=8).digest(), "big") for sh in shingles]
+    return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in MINHASH_PARAMS)
+
+class NearDuplicateIndex:
+    """In-process LSH index mapping MinHash signatures to response cache keys"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.signatures = OrderedDict()  # key -> (context_hash, signature)
+        self.buckets = {}  # (context_hash, band, rows) -> set of keys
+        self.lock = threading.Lock()
+
+    def _bands(self, context_hash, signature):
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        for band in range(MINHASH_BANDS):
+            yield (context_hash, band, signature[band * rows:(band + 1) * rows])
+
+    def add(self, key, signature):
+        context_hash = key.split(":")[1]
+        with self.lock:
+            if key in self.signatures:
+                self.signatures.move_to_end(key)
+                return
+            self.signatures[key] = (context_hash, signature)
+            for bucket in self._bands(context_hash, signature):
+                self.buckets.setdefault(bucket, set()).add(key)
+            while len(self.signatures) > self.max_entries:
+                old_key, (old_context, old_signature) = self.signatures.popitem(last=False)
+                for bucket in self._bands(old_context, old_signature):
+                    keys = self.buckets.get(bucket)
+                    if keys:
+                        keys.discard(old_key)
+                        if not keys:
+                            del self.buckets[bucket]
+
+    def find(self, key, signature):
+        """Best candidate with the same grounding context above the threshold"""
+        context_hash = key.split(":")[1]
+        with self.lock:
+            candidates = set()
+            for bucket in self._bands(context_hash, signature):
+                candidates |= self.buckets.get(bucket, set())
+            best, best_score = None, NEAR_DUPLICATE_THRESHOLD
+            for candidate in candidates:
+                other = self.signatures[candidate][1]
+                score = sum(x == y for x, y in zip(signature, other)) / MINHASH_PERMUTATIONS
+                if score >= best_score:
+                    best, best_score = candidate, score
+            return best
+
+near_duplicate_index = NearDuplicateIndex()
+
+def lookup_cached_response(key, normalized):
+    """Return (reply, hit_type) where hit_type is "exact", "near" or None"""
+    found, reply = response_cache.get("response", key)
+    if found and reply:
+        return reply, "exact"
+    if NEAR_DUPLICATE_LOOKUP:
+        similar = near_duplicate_index.find(key, minhash_signature(normalized))
+        if similar:
+            found, reply = response_cache.get("response", similar)
+            if found and reply:
+                return reply, "near"
+    return None, None
+
+def store_cached_response(key, normalized, reply):
+    if not key or not reply:
+        return
+    response_cache.set("response", key, reply)
+    if NEAR_DUPLICATE_LOOKUP:
+        near_duplicate_index.add(key, minhash_signature(normalized))
+
+# Conversation sessions: turns live server-side, the model state after each turn is kept for the next
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(60 * 60 * 6)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "5000"))
+SESSION_HISTORY_LIMIT = int(os.getenv("SESSION_HISTORY_LIMIT", "6"))  # Turns kept in a session prompt
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "400"))  # Leaves room for new sources and the question
+SESSION_STATE_MEMORY_BYTES = int(os.getenv("SESSION_STATE_MEMORY_MB", "0")) * 1024 * 1024  # 0: sized from the model
+SESSION_STATE_SESSIONS = int(os.getenv("SESSION_STATE_SESSIONS", "32"))  # Half-context states the sized budget holds
+SESSION_STATE_UNSIZED_BYTES = 256 * 1024 * 1024  # Budget until a model has been measured
+SESSION_SPILL_QUEUE = 16  # States waiting for the spill thread; more are evicted
+SESSION_STATE_DISK_BYTES = int(os.getenv("SESSION_STATE_DISK_MB", "2048")) * 1024 * 1024
+SESSION_STATE_DIR = os.getenv("SESSION_STATE_DIR")  # Parent of the spill directory (default: system temp)
+
+session_cache = KnowledgeCache(max_entries=SESSION_MAX_ENTRIES, ttls={"session": SESSION_TTL})
+
+def state_nbytes(tokens, state):
+    """llama.cpp's state plus the input_ids and scores arrays llama-cpp-python copies into it"""
+    arrays = sum(getattr(getattr(state, name, None), "nbytes", 0) for name in ("input_ids", "scores"))
+    return getattr(state, "llama_state_size", 0) + arrays + 4 * len(tokens)
+
+class SessionStateStore:
+    """Byte-bounded LRU of (tokens, model state) per session and tier.
+
+    States pushed out of memory are pickled by a background thread to a
+    per-process spill directory, itself bounded by SESSION_STATE_DISK_BYTES;
+    a state read back from disk (or reclaimed before it was written) moves to
+    memory again.
+    """
+
+    def __init__(self, memory_bytes=SESSION_STATE_MEMORY_BYTES or SESSION_STATE_UNSIZED_BYTES,
+                 disk_bytes=SESSION_STATE_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()  # key -> (tokens, state, nbytes)
+        self.spilling = {}  # key -> (tokens, state, nbytes) queued for the spill thread
+        self.disk = OrderedDict()  # key -> nbytes
+        self.memory_used = 0
+        self.disk_used = 0
+        self.spill_dir = None
+        self.spill_queue = queue.Queue(SESSION_SPILL_QUEUE)
+        self.spill_thread = None
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "spills": 0, "evictions": 0}
+
+    def _path(self, key):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="sawa-sessions-", dir=SESSION_STATE_DIR)
+            atexit.register(shutil.rmtree, self.spill_dir, True)
+        return os.path.join(self.spill_dir, f"{key}.state")
+
+    def get(self, key):
+        """(tokens, state) or None"""
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0], entry[1]
+            entry = self.spilling.pop(key, None)
+            if entry is None:
+                on_disk = self.disk.pop(key, None)
+                if on_disk is None:
+                    self.stats["misses"] += 1
+                    return None
+                self.disk_used -= on_disk
+                path = self._path(key)
+        if entry is not None:
+            self._count("hits")
+            self.put(key, entry[0], entry[1])
+            return entry[0], entry[1]
+        try:
+            with open(path, "rb") as f:
+                tokens, state = pickle.load(f)
+            os.remove(path)
+        except Exception as e:
+            logger.warning(f"Session state spill unreadable: {e}")
+            self._count("misses")
+            return None
+        self._count("disk_hits")
+        self.put(key, tokens, state)
+        return tokens, state
+
+    def put(self, key, tokens, state):
+        nbytes = state_nbytes(tokens, state)
+        with self.lock:
+            self.spilling.pop(key, None)  # A newer state supersedes one still waiting to be written
+            old = self.memory.pop(key, None)
+            if old is not None:
+                self.memory_used -= old[2]
+            self.memory[key] = (tokens, state, nbytes)
+            self.memory_used += nbytes
+            self.stats["stores"] += 1
+            while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+                old_key, old_entry = self.memory.popitem(last=False)
+                self.memory_used -= old_entry[2]
+                if old_entry[2] > self.disk_bytes:
+                    self.stats["evictions"] += 1
+                    continue
+                try:
+                    self.spill_queue.put_nowait(old_key)
+                except queue.Full:  # The disk is behind; never block the request on it
+                    self.stats["evictions"] += 1
+                    continue
+                self.spilling[old_key] = old_entry
+            if self.spilling and self.spill_thread is None:
+                self.spill_thread = threading.Thread(target=self._spill_loop, name="session-spill", daemon=True)
+                self.spill_thread.start()
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _spill_loop(self):
+        while True:
+            key = self.spill_queue.get()
+            with self.lock:
+                entry = self.spilling.get(key)
+            if entry is not None:
+                self._spill(key, entry)
+
+    def _spill(self, key, entry):
+        tokens, state, nbytes = entry
+        path = self._path(key)
+        try:
+            with open(path, "wb") as f:
+                pickle.dump((tokens, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning(f"Session state spill failed: {e}")
+            with self.lock:
+                if self.spilling.get(key) is entry:
+                    del self.spilling[key]
+                    self.stats["evictions"] += 1
+            return
+        dropped = []
+        with self.lock:
+            if self.spilling.get(key) is not entry:
+                dropped.append(path)  # Reclaimed or replaced while it was being written
+            else:
+                del self.spilling[key]
+                old_bytes = self.disk.pop(key, None)
+                if old_bytes is not None:
+                    self.disk_used -= old_bytes
+                self.disk[key] = nbytes
+                self.disk_used += nbytes
+                self.stats["spills"] += 1
+                while self.disk_used > self.disk_bytes:
+                    old_key, old_bytes = self.disk.popitem(last=False)
+                    self.disk_used -= old_bytes
+                    self.stats["evictions"] += 1
+                    dropped.append(self._path(old_key))
+        for path in dropped:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def snapshot_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update(
+                memory_entries=len(self.memory), memory_bytes=self.memory_used, memory_budget=self.memory_bytes,
+                spilling=len(self.spilling), disk_entries=len(self.disk), disk_bytes=self.disk_used
+            )
+        return stats
+
+session_states = SessionStateStore()
+
+def size_session_states():
+    """Unless SESSION_STATE_MEMORY_MB is set, budget SESSION_STATE_SESSIONS half-context states
+    at the bytes per token measured on the loaded system-prompt states"""
+    if SESSION_STATE_MEMORY_BYTES or not prefix_states:
+        return
+    per_token = max(state_nbytes(tokens, state) / max(1, len(tokens)) for tokens, state in prefix_states.values())
+    n_ctx = max(tier.n_ctx for tier in llm_tiers)
+    session_states.memory_bytes = int(SESSION_STATE_SESSIONS * per_token * n_ctx / 2)
+    logger.info(
+        f"Session state budget: {session_states.memory_bytes / 2**20:.0f}MB "
+        f"({per_token / 1024:.1f}KB per token, {SESSION_STATE_SESSIONS} states of {n_ctx // 2} tokens)"
+    )
+
+def capture_session_state(model):
+    """(tokens, state) the model holds right after a generation"""
+    return list(model.input_ids[:model.n_tokens]), compact_state(model.save_state())
+
+class UnknownSession(Exception):
+    """Raised for a session_id the server never issued, or one that has expired"""
+
+class ChatSession:
+    """Server-side turns of one conversation, shared across processes through session_cache.
+
+    Only IDs minted by ChatSession.start() are accepted, so a client cannot
+    reach another conversation by guessing or reusing a simple ID.
+    """
+
+    def __init__(self, session_id):
+        self.key = hashlib.blake2b(session_id.encode("utf-8"), digest_size=16).hexdigest()
+        found, record = session_cache.get("session", f"session:{self.key}")
+        if not found:
+            raise UnknownSession("Unknown or expired session_id")
+        self.turns = list(record["turns"])
+
+    @staticmethod
+    def start() -> str:
+        """Mint a 128-bit session_id and register it with no turns"""
+        session_id = secrets.token_hex(16)
+        key = hashlib.blake2b(session_id.encode("utf-8"), digest_size=16).hexdigest()
+        session_cache.set("session", f"session:{key}", {"turns": []})
+        return session_id
+
+    def state_key(self, tier):
+        """Model states are only valid for the tier that produced them"""
+        return f"{self.key}-{tier.name}"
+
+    def remember(self, user_input, reply, sources=()):
+        turns = self.turns + [{"user": user_input, "ai": reply, "sources": list(sources)}]
+        costs = [segment_token_count(session_turn_segment(t)) for t in turns]
+        if len(turns) > SESSION_HISTORY_LIMIT or sum(costs) > SESSION_HISTORY_TOKENS:
+            # Cut down to half the limits at once, not one turn per request, so the prompt
+            # prefix (and the saved state) stays reusable for the next few turns
+            keep, budget = 1, SESSION_HISTORY_TOKENS // 2 - costs[-1]
+            while keep < min(len(turns), SESSION_HISTORY_LIMIT // 2) and costs[-keep - 1] <= budget:
+                budget -= costs[-keep - 1]
+                keep += 1
+            turns = turns[-keep:]
+        self.turns = turns
+        session_cache.set("session", f"session:{self.key}", {"turns": turns})
 
 # Enhanced clinical responses for minimal inputs
 MINIMAL_RESPONSES = {
@@ -533,75 +2278,894 @@ MINIMAL_RESPONSES = {
     "diarrhea": "**Diarrhea Management**\n- Acute: Supportive care + hydration\n- Infectious: C. diff (vancomycin), Giardia (metronidazole)\n- Chronic: Consider IBS, IBD, malabsorption"
 }
 
+# Knowledge cache snapshot: hot terms are fetched ahead of time (prewarm.py) and
+# loaded at boot, so a fresh process answers them without network traffic
+CACHE_SNAPSHOT_PATH = os.getenv(
+    "CACHE_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_cache.snapshot")
+)
+CACHE_SNAPSHOT_VERSION = 2  # 2: BLAKE2b lookup keys
+PREWARM_ON_STARTUP = os.getenv("PREWARM_ON_STARTUP", "0") == "1"  # Refresh and rewrite the snapshot after boot
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", "60"))  # seconds
+
+def hot_terms() -> list:
+    """Acronyms and their expansions, shorthand expansions and the MINIMAL_RESPONSES keys"""
+    terms = list(MEDICAL_ACRONYMS) + list(MEDICAL_ACRONYMS.values())
+    terms += list(MEDICAL_SHORTHAND.values()) + list(MINIMAL_RESPONSES)
+    return list(dict.fromkeys(term.lower() for term in terms))
+
+def prewarm_cache(terms=None, timeout=PREWARM_TIMEOUT) -> dict:
+    """Fetch every knowledge source and the dictionary for each term, all in parallel"""
+    terms = terms or hot_terms()
+    futures = {}
+    for term in terms:
+        for source in MEDICAL_KNOWLEDGE_HUB:
+            futures[(source, term)] = grounding_executor.submit(fetch_medical_snippet, term, source)
+        futures[("dict", term)] = grounding_executor.submit(lookup_dictionary, term)
+    results = gather_until(futures, time.monotonic() + timeout, cancel=False)
+    found = sum(1 for value in results.values() if not is_negative_result(value))
+    logger.info(f"Pre-warmed {len(terms)} terms: {found}/{len(futures)} fetches returned content")
+    return {"terms": len(terms), "fetches": len(futures), "found": found}
+
+def save_cache_snapshot(path=CACHE_SNAPSHOT_PATH) -> int:
+    """Write the positive knowledge_cache entries to a gzipped JSON snapshot"""
+    now = time.time()
+    entries = [[key, value, round(now + ttl)] for key, value, ttl in knowledge_cache.export_entries()]
+    body = json.dumps(
+        {"version": CACHE_SNAPSHOT_VERSION, "created_at": round(now), "entries": entries},
+        separators=(",", ":")
+    ).encode("utf-8")
+    # A unique temp file beside the snapshot: concurrent writers never share it and the rename stays atomic
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logger.info(f"Cache snapshot written: {len(entries)} entries to {path}")
+    return len(entries)
+
+def load_cache_snapshot(path=CACHE_SNAPSHOT_PATH) -> int:
+    """Seed the in-process cache from a snapshot, skipping expired entries"""
+    if not os.path.exists(path):
+        raise ComponentSkipped(f"No cache snapshot at {path}")
+    with gzip.open(path, "rb") as f:
+        snapshot = json.loads(f.read())
+    if snapshot.get("version") != CACHE_SNAPSHOT_VERSION:
+        raise ValueError(f"Cache snapshot version {snapshot.get('version')}, expected {CACHE_SNAPSHOT_VERSION}")
+    now = time.time()
+    loaded = 0
+    for key, value, expires_at in snapshot["entries"]:
+        if expires_at > now:
+            knowledge_cache.set_local(key, value, expires_at - now)
+            loaded += 1
+    logger.info(f"Cache snapshot loaded: {loaded}/{len(snapshot['entries'])} entries still fresh")
+    return loaded
+
+def refresh_cache_snapshot():
+    """Startup hook: fetch the hot terms the snapshot is missing, then rewrite it"""
+    try:
+        prewarm_cache()
+        save_cache_snapshot()
+    except Exception as e:
+        logger.warning(f"Cache pre-warming failed: {e}")
+
+# Startup lifecycle: components load concurrently in the background so
+# /health and /ready answer while the model is still loading
+WARMUP = os.getenv("WARMUP", "1") == "1"
+REQUIRED_COMPONENTS = ("spacy", "model")
+
+class ComponentSkipped(Exception):
+    """Raised by an optional component's loader when there is nothing to load"""
+
+COMPONENT_LOADERS = {
+    "spacy": load_spacy,
+    "model": load_models,
+    "redis": connect_redis,
+    "local_index": load_local_knowledge,
+    "cache_snapshot": load_cache_snapshot
+}
+component_status = {
+    name: {"state": "pending", "load_seconds": None, "error": None} for name in COMPONENT_LOADERS
+}
+startup_state = {
+    "ready": False, "started_at": None, "total_seconds": None, "warmup_seconds": None, "warmup_error": None
+}
+
+def run_component(name):
+    status = component_status[name]
+    status["state"] = "loading"
+    start = time.monotonic()
+    try:
+        COMPONENT_LOADERS[name]()
+        status["state"] = "ready"
+    except ComponentSkipped as e:
+        status["state"] = "skipped"
+        status["error"] = str(e)
+    except Exception as e:
+        status["state"] = "failed"
+        status["error"] = str(e)
+        logger.error(f"{name} failed to load: {e}")
+    finally:
+        status["load_seconds"] = round(time.monotonic() - start, 3)
+        logger.info(f"{name} {status['state']} in {status['load_seconds']}s")
+
+def warm_up():
+    """Run a short generation on every worker and one spaCy parse so first requests hit warm caches"""
+    start = time.monotonic()
+    if nlp is not None:
+        expand_medical_terms(QueryAnalysis("chest pain management").terms)
+    prompt = build_prompt([], "What is hypertension?", [])
+    for instance in llm_instances:
+        try:
+            ensure_prefix_state(instance)
+            instance(prompt, max_tokens=8, temperature=0.0)
+        except Exception as e:
+            logger.warning(f"Warm-up generation failed: {e}")
+    startup_state["warmup_seconds"] = round(time.monotonic() - start, 3)
+    logger.info(f"Warm-up done in {startup_state['warmup_seconds']}s")
+
+def initialize_components(warmup=WARMUP):
+    """Load every component concurrently, then warm up; blocks until done"""
+    started = time.monotonic()
+    startup_state["started_at"] = time.time()
+    with ThreadPoolExecutor(max_workers=len(COMPONENT_LOADERS), thread_name_prefix="startup") as pool:
+        list(pool.map(run_component, COMPONENT_LOADERS))
+    if warmup and llm_instances:
+        try:
+            warm_up()
+        except Exception as e:
+            # Only the first requests get slower; readiness still follows the components
+            startup_state["warmup_error"] = str(e)
+            logger.error(f"Warm-up failed: {e}")
+    startup_state["total_seconds"] = round(time.monotonic() - started, 3)
+    startup_state["ready"] = all(component_status[name]["state"] == "ready" for name in REQUIRED_COMPONENTS)
+    logger.info(f"Startup finished in {startup_state['total_seconds']}s (ready={startup_state['ready']})")
+    if PREWARM_ON_STARTUP and not OFFLINE_MODE:
+        threading.Thread(target=refresh_cache_snapshot, name="prewarm", daemon=True).start()
+
+def starting_response():
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Service starting", "detail": "Models are still loading", "retry_after": 5},
+        headers={"Retry-After": "5"}
+    )
+
+def still_starting():
+    return any(component_status[name]["state"] in ("pending", "loading") for name in REQUIRED_COMPONENTS)
+
+def required_component_failed():
+    return any(component_status[name]["state"] == "failed" for name in REQUIRED_COMPONENTS)
+
+# Readiness: 200 only once the required components are loaded and warmed up
+@app.get("/ready")
+def readiness_check():
+    body = {"ready": startup_state["ready"], "components": component_status, "startup": startup_state}
+    return body if startup_state["ready"] else JSONResponse(status_code=503, content=body)
+
 # Health check endpoint
 @app.get("/health")
 def health_check():
     status = {
-        "status": "operational" if llm else "degraded",
+        "status": "starting" if still_starting() else (
+            "degraded" if required_component_failed() or not llm else "operational"
+        ),
         "llm_loaded": bool(llm),
         "redis_available": bool(redis_client),
+        "scheduler": llm_scheduler.snapshot_stats() if llm_scheduler else None,
+        "tiers": {tier.name: tier.snapshot_stats() for tier in llm_tiers},
+        "session_states": session_states.snapshot_stats(),
+        "sources": {name: health.snapshot_stats() for name, health in source_health.items()},
+        "cache": knowledge_cache.snapshot_stats(),
+        "response_cache": response_cache.snapshot_stats(),
+        "redis_writer": redis_writer.snapshot_stats(),
+        "single_flight": {
+            flight.name: flight.snapshot_stats() for flight in (upstream_flight, generation_flight)
+        },
         "context_window": CONTEXT_WINDOW,
-        "knowledge_sources": list(MEDICAL_KNOWLEDGE_HUB.keys())
+        "process": {"pid": os.getpid(), "llm_threads": LLM_THREADS, "use_mmap": MODEL_USE_MMAP},
+        "knowledge_sources": list(MEDICAL_KNOWLEDGE_HUB.keys()),
+        "local_index_docs": len(local_knowledge) if local_knowledge else 0,
+        "offline_mode": OFFLINE_MODE,
+        "components": component_status,
+        "startup": startup_state
     }
     return status
 
+# Clinical reply formatting
+def format_clinical_reply(reply: str) -> str:
+    """Ensure the reply leads with a **Summary** section"""
+    if "**Summary**" not in reply:
+        first_period = reply.find('.')
+        if first_period != -1:
+            summary = reply[:first_period+1]
+            details = reply[first_period+1:]
+            reply = f"**Summary**: {summary}\n\n**Details**: {details}"
+        else:
+            reply = f"**Summary**: {reply}"
+    return reply
+
+class StreamingReplyFormatter:
+    """Incremental version of format_clinical_reply for streamed tokens.
+
+    Text is held back only until we know whether the model opened with
+    **Summary** itself; after that every chunk is forwarded immediately,
+    with the **Details** header spliced in at the first period.
+    """
+    MARKER = "**Summary**"
+
+    def __init__(self):
+        self.pending = ""
+        self.passthrough = None  # None until the opening has been seen
+        self.in_details = False
+        self.reply = ""
+
+    def _emit(self, text: str) -> str:
+        self.reply += text
+        return text
+
+    def _format(self, text: str) -> str:
+        if self.passthrough or self.in_details:
+            return text
+        first_period = text.find('.')
+        if first_period == -1:
+            return text
+        self.in_details = True
+        return text[:first_period+1] + "\n\n**Details**: " + text[first_period+1:]
+
+    def feed(self, token: str) -> str:
+        if self.passthrough is None:
+            self.pending += token
+            head = self.pending.lstrip()
+            if not head:
+                return ""
+            if head.startswith(self.MARKER):
+                self.passthrough = True
+            elif self.MARKER.startswith(head) and '.' not in head:
+                return ""  # Could still become **Summary**
+            else:
+                self.passthrough = False
+                head = "**Summary**: " + self._format(head)
+            self.pending = ""
+            return self._emit(head)
+        return self._emit(self._format(token))
+
+    def finish(self) -> str:
+        tail = ""
+        if self.passthrough is None and self.pending.strip():
+            # Stream ended inside a partial marker
+            self.passthrough = False
+            tail = "**Summary**: " + self._format(self.pending.lstrip())
+        self.pending = ""
+        self._emit(tail)
+        self.reply = self.reply.rstrip()
+        return tail
+
+class ChatPlan:
+    """What prepare_chat decided: a ready reply, or a prompt to generate from"""
+
+    def __init__(self, result=None, prompt=None, response_key=None, normalized=None,
+                 session=None, user_input=None, sources=(), history=(), grounding=(), budget=None):
+        self.result = result
+        self.prompt = prompt
+        self.response_key = response_key
+        self.normalized = normalized
+        self.session = session
+        self.user_input = user_input
+        self.sources = sources  # Source texts the prompt used, kept in the session turn
+        self.history = history
+        self.grounding = grounding
+        self.budget = budget  # Prompt token budget the prompt was trimmed to
+        self.trace = None
+
+    def fit(self, tier):
+        """Re-trim the prompt when admission fell back to a tier with a smaller context"""
+        if self.budget and tier.max_prompt_tokens < self.budget:
+            self.prompt, self.sources = trim_prompt(
+                self.history, self.user_input, self.grounding, tier.max_prompt_tokens, session=bool(self.session)
+            )
+            self.budget = tier.max_prompt_tokens
+
+    def state_key(self, ticket):
+        return self.session.state_key(ticket.tier) if self.session else None
+
+    def remember(self, reply, raw=None):
+        """Add the turn to the session; raw is the unformatted text exactly as the model generated it"""
+        if self.session:
+            self.session.remember(self.user_input, raw if raw is not None else " " + reply, self.sources)
+
+    def store(self, reply, raw=None):
+        store_cached_response(self.response_key, self.normalized, reply)
+        self.remember(reply, raw)
+
+def prepare_chat(req: ChatRequest, analysis: QueryAnalysis = None, fetches: SharedFetches = None,
+                 max_prompt_tokens: int = None, tiers: list = None) -> ChatPlan:
+    """Resolve a request to either a canned/cached reply or a generation prompt.
+
+    With `tiers`, raises SchedulerSaturated before grounding when none of them has room.
+    """
+    user_input = req.message.strip()
+    session = ChatSession(req.session_id) if req.session_id else None
+    history = session.turns if session else (req.history or [])
+    
+    logger.info(f"Received query: {user_input}")
+    
+    # Handle minimal inputs
+    if len(user_input) <= 3:
+        lc_input = user_input.lower()
+        if lc_input in MINIMAL_RESPONSES:
+            return ChatPlan({"reply": MINIMAL_RESPONSES[lc_input]}, session=session, user_input=user_input)
+        
+        # Expand medical shorthand
+        processed_input, _ = handle_minimal_input(user_input)
+        if processed_input != user_input:
+            return ChatPlan(
+                {"reply": f"Interpreting '{user_input}' as '{processed_input}'. Please provide more details."},
+                session=session, user_input=user_input
+            )
+    
+    if tiers:
+        ensure_capacity(tiers)
+    
+    # Build clinical context
+    analysis = analysis or QueryAnalysis(user_input)
+    check_cancelled("grounding")
+    sources = build_grounding(user_input, analysis=analysis, fetches=fetches)
+    check_cancelled("grounding")
+    logger.info(f"Using {len(sources)} sources")
+    
+    # Serve repeated questions over the same grounding from the response cache
+    normalized = normalize_query(user_input, analysis.terms)
+    response_key = response_cache_key(normalized, history, sources, session=bool(session))
+    with stage("response_cache"):
+        reply, hit = lookup_cached_response(response_key, normalized)
+    if reply:
+        logger.info(f"Response cache hit ({hit})")
+        return ChatPlan(
+            {"reply": reply, "cache": hit}, session=session, user_input=user_input,
+            sources=[source['content'] for source in sources]
+        )
+    
+    # Prepare token-safe prompt
+    with stage("prompt_budget"):
+        prompt, used = trim_prompt(history, user_input, sources, max_prompt_tokens, session=bool(session))
+    return ChatPlan(
+        prompt=prompt, response_key=response_key, normalized=normalized,
+        session=session, user_input=user_input, sources=used,
+        history=history, grounding=sources, budget=max_prompt_tokens
+    )
+
+def generate_tokens(model, prompt, trace=None):
+    """Stream completion text, recording prompt eval (time to first token), decode time and tokens/sec"""
+    start = time.monotonic()
+    first = None
+    tokens = 0
+    draft = getattr(model, "draft_model", None)
+    drafted = (draft.calls, draft.proposed) if isinstance(draft, CountingDraftModel) else None
+    stream = model(prompt, stream=True, **GENERATION_KWARGS)
+    try:
+        for chunk in stream:
+            if is_cancelled():
+                raise RequestCancelled("generation")
+            if first is None:
+                first = time.monotonic()
+                observe_stage("prompt_eval", first - start, trace)
+            tokens += 1
+            yield chunk["choices"][0]["text"]
+    except (RequestCancelled, GeneratorExit):
+        # Stop decoding now; the model goes back to the pool with a partial KV cache
+        TOKENS_SAVED.inc(max(0, GENERATION_KWARGS.get("max_tokens", GENERATE_TOKENS) - tokens))
+        raise
+    finally:
+        stream.close()
+        if first is not None:
+            decode = time.monotonic() - first
+            observe_stage("decode", decode, trace)
+            GENERATED_TOKENS.inc(tokens)
+            if tokens > 1 and decode > 0:
+                TOKENS_PER_SECOND.observe((tokens - 1) / decode)
+        if drafted:
+            calls, proposed = draft.calls - drafted[0], draft.proposed - drafted[1]
+            DRAFT_TOKENS.inc(proposed, result="proposed")
+            DRAFT_TOKENS.inc(accepted_draft_tokens(calls, proposed, tokens), result="accepted")
+
+# Identical final prompts share one generation
+generation_flight = SingleFlight("generation")
+
+def generate_reply(ticket, prompt, trace=None, state_key=None):
+    """Check out a model and generate the whole completion for a prompt.
+
+    With a session state_key the model starts from the session's saved state
+    and the state after this turn is saved for the next one.
+    """
+    with ticket.model(session_states.get(state_key)) as model:
+        reply = "".join(generate_tokens(model, prompt, trace))
+        saved = capture_session_state(model) if state_key else None
+    if saved:
+        session_states.put(state_key, *saved)
+    return reply
+
+def coalesced_reply(ticket, prompt, trace=None, state_key=None):
+    """generate_reply through generation_flight; (reply, shared).
+
+    Only requests for the same prompt on the same tier and session share a
+    generation. If the leader's client disconnects, waiting requests generate
+    for themselves.
+    """
+    key = prompt_key(prompt, ticket.tier.name, state_key)
+    while True:
+        try:
+            return generation_flight.do(key, generate_reply, ticket, prompt, trace, state_key)
+        except RequestCancelled:
+            check_cancelled("generation")
+
+def prompt_key(prompt, tier=None, state_key=None):
+    digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16)
+    digest.update(f"\0{tier or ''}\0{state_key or ''}".encode("utf-8"))
+    return digest.hexdigest()
+
+def plan_outcome(plan):
+    if plan.result is None:
+        return "generated"
+    return "cached" if plan.result.get("cache") else "canned"
+
+def unknown_session_response(e: UnknownSession):
+    return JSONResponse(status_code=404, content={"error": str(e), "detail": "Start a session with POST /session"})
+
+# Sessions: the server mints every session_id
+@app.post("/session")
+def start_session():
+    return {"session_id": ChatSession.start(), "ttl": SESSION_TTL}
+
 # Main endpoint with enhanced error handling
 @app.post("/chat")
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest, request: Request):
+    """Run the pipeline in the threadpool and cancel it if the client disconnects"""
+    cancel = threading.Event()
+    work = asyncio.ensure_future(run_in_threadpool(run_chat, req, cancel))
+    while not work.done():
+        await asyncio.wait({work}, timeout=CANCEL_POLL_INTERVAL)
+        if not work.done() and await request.is_disconnected():
+            cancel.set()
+            break
+    return await work
+
+def run_chat(req: ChatRequest, cancel: threading.Event = None):
+    current_cancel.set(cancel)
+    ticket = None
+    outcome = "error"
     try:
+        if still_starting():
+            outcome = "starting"
+            return starting_response()
+        
         # Check if LLM is loaded
-        if not llm:
+        if not llm_scheduler:
             return {"error": "AI model not available", "detail": "LLM failed to initialize"}
         
-        user_input = req.message.strip()
-        history = req.history or []
-        
-        logger.info(f"Received query: {user_input}")
+        # Plan for the tier the query's complexity selects; canned and cached replies never take a slot,
+        # and a request no tier has room for is rejected before grounding
+        trace = start_trace()
+        analysis = QueryAnalysis(req.message.strip())
         
-        # Handle minimal inputs
-        if len(user_input) <= 3:
-            lc_input = user_input.lower()
-            if lc_input in MINIMAL_RESPONSES:
-                return {"reply": MINIMAL_RESPONSES[lc_input]}
+        with maybe_profile():
+            tiers = routed_tiers(req.message, analysis.terms)
+            plan = prepare_chat(req, analysis, max_prompt_tokens=tiers[-1].max_prompt_tokens, tiers=tiers)
+            outcome = plan_outcome(plan)
+            if plan.result is not None:
+                plan.remember(plan.result["reply"])
+                return plan.result
             
-            # Expand medical shorthand
-            processed_input, _ = handle_minimal_input(user_input)
-            if processed_input != user_input:
-                return {"reply": f"Interpreting '{user_input}' as '{processed_input}'. Please provide more details."}
-        
-        # Build clinical context
-        sources = build_grounding(user_input)
-        logger.info(f"Using {len(sources)} sources")
-        
-        # Prepare token-safe prompt
-        prompt = prepare_prompt_and_trim(history, user_input, sources)
-        
-        # Generate response
-        output = llm(
-            prompt,
-            max_tokens=GENERATE_TOKENS,
-            stop=["User:", "AI:", "###"],
-            temperature=0.3,  # More deterministic
-            repeat_penalty=1.2  # Reduce repetition
-        )
+            # Admit only now that generation is needed, falling back to a smaller tier with room
+            ticket = admit_routed(req.message, analysis.terms)
+            plan.fit(ticket.tier)
+            
+            # Generate response (or wait for an identical prompt already generating)
+            raw, shared = coalesced_reply(ticket, plan.prompt, trace, plan.state_key(ticket))
+            if shared:
+                outcome = "coalesced"
+            observe_stage("queue_wait", ticket.queue_wait, trace)
+            logger.info(f"Queue wait {ticket.queue_wait:.2f}s, generation {ticket.generation:.2f}s")
         
-        reply = output["choices"][0]["text"].strip()
+        reply = raw.strip()
         
         # Post-process for clinical relevance
-        if "**Summary**" not in reply:
-            first_period = reply.find('.')
-            if first_period != -1:
-                summary = reply[:first_period+1]
-                details = reply[first_period+1:]
-                reply = f"**Summary**: {summary}\n\n**Details**: {details}"
-            else:
-                reply = f"**Summary**: {reply}"
-        
-        return {"reply": reply}
+        reply = format_clinical_reply(reply)
+        plan.store(reply, raw)
+        return {"reply": reply, "cache": "miss", "model_tier": ticket.tier.name, "timings": dict(ticket.timings(), **trace)}
     
+    except SchedulerSaturated as e:
+        outcome = "busy"
+        logger.warning(str(e))
+        return busy_response(e)
+    except UnknownSession as e:
+        outcome = "unknown_session"
+        return unknown_session_response(e)
+    except RequestCancelled as e:
+        outcome = "cancelled"
+        CANCELLED.inc(endpoint="chat", stage=e.stage)
+        logger.info(str(e))
+        return JSONResponse(status_code=499, content={"error": "Client disconnected"})
     except requests.exceptions.RequestException as e:
         logger.error(f"Network error: {e}")
         return {"error": "Medical knowledge services unavailable"}
     except Exception as e:
         logger.exception("Critical chat error")
         return {"error": "Clinical processing failed", "detail": str(e)}
+    finally:
+        REQUESTS.inc(endpoint="chat", outcome=outcome)
+        if ticket:
+            ticket.release()
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Encode one Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+class TicketedBody:
+    """Response body that owns admitted tickets until it ends.
+
+    A generator's finally only runs once iteration has started, so a body the
+    server never reads (client gone before the first chunk, failed send) would
+    hold its tickets forever. This releases them when the body is exhausted,
+    closed, or dropped unread.
+    """
+
+    def __init__(self, events, tickets):
+        self.events = events
+        self.tickets = tickets
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.events)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            self.events.close()
+        finally:
+            for ticket in self.tickets:
+                ticket.release()
+
+    def __del__(self):
+        self.close()
+
+def sse_response(events):
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def stream_chat_events(plan: ChatPlan, ticket: InferenceTicket, trace: dict):
+    """Yield SSE frames for a planned generation as tokens are decoded"""
+    outcome = "generated"
+    try:
+        formatter = StreamingReplyFormatter()
+        raw = []
+        state_key = plan.state_key(ticket)
+        with ticket.model(session_states.get(state_key)) as model:
+            for piece in generate_tokens(model, plan.prompt, trace):
+                raw.append(piece)
+                text = formatter.feed(piece)
+                if text:
+                    yield sse_event({"token": text})
+            saved = capture_session_state(model) if state_key else None
+        if saved:
+            session_states.put(state_key, *saved)
+        observe_stage("queue_wait", ticket.queue_wait, trace)
+        tail = formatter.finish()
+        if tail:
+            yield sse_event({"token": tail})
+        plan.store(formatter.reply, "".join(raw))
+        yield sse_event({
+            "reply": formatter.reply, "cache": "miss", "model_tier": ticket.tier.name,
+            "timings": dict(ticket.timings(), **trace)
+        }, "done")
+    
+    except GeneratorExit:
+        # Starlette stops iterating when the client disconnects; closing us stops the decode
+        outcome = "cancelled"
+        CANCELLED.inc(endpoint="chat_stream", stage="generation")
+        raise
+    except Exception as e:
+        logger.exception("Critical chat stream error")
+        yield sse_event({"error": "Clinical processing failed", "detail": str(e)}, "error")
+    finally:
+        REQUESTS.inc(endpoint="chat_stream", outcome=outcome)
+        ticket.release()
+
+# Streaming endpoint: same pipeline, tokens pushed as Server-Sent Events
+@app.post("/chat/stream")
+def chat_stream(req: ChatRequest):
+    if still_starting():
+        REQUESTS.inc(endpoint="chat_stream", outcome="starting")
+        return starting_response()
+    if not llm_scheduler:
+        return {"error": "AI model not available", "detail": "LLM failed to initialize"}
+    
+    # Plan before streaming starts; canned and cached replies never take a slot, and a
+    # request no tier has room for is rejected before grounding
+    trace = start_trace()
+    analysis = QueryAnalysis(req.message.strip())
+    try:
+        tiers = routed_tiers(req.message, analysis.terms)
+        plan = prepare_chat(req, analysis, max_prompt_tokens=tiers[-1].max_prompt_tokens, tiers=tiers)
+    except SchedulerSaturated as e:
+        REQUESTS.inc(endpoint="chat_stream", outcome="busy")
+        logger.warning(str(e))
+        return busy_response(e)
+    except UnknownSession as e:
+        REQUESTS.inc(endpoint="chat_stream", outcome="unknown_session")
+        return unknown_session_response(e)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Network error: {e}")
+        REQUESTS.inc(endpoint="chat_stream", outcome="error")
+        return sse_response(iter([sse_event({"error": "Medical knowledge services unavailable"}, "error")]))
+    except Exception as e:
+        logger.exception("Critical chat stream error")
+        REQUESTS.inc(endpoint="chat_stream", outcome="error")
+        return sse_response(iter([sse_event({"error": "Clinical processing failed", "detail": str(e)}, "error")]))
+    if plan.result is not None:
+        plan.remember(plan.result["reply"])
+        REQUESTS.inc(endpoint="chat_stream", outcome=plan_outcome(plan))
+        return sse_response(iter([sse_event({"token": plan.result["reply"]}), sse_event(plan.result, "done")]))
+    
+    # Admit before streaming starts so saturation is a real 503
+    try:
+        ticket = admit_routed(req.message, analysis.terms)
+    except SchedulerSaturated as e:
+        REQUESTS.inc(endpoint="chat_stream", outcome="busy")
+        logger.warning(str(e))
+        return busy_response(e)
+    plan.fit(ticket.tier)
+    
+    return sse_response(TicketedBody(stream_chat_events(plan, ticket, trace), [ticket]))
+
+# Batch chat: many requests share term extraction, upstream fetches and LLM workers
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "500"))
+BATCH_GROUNDING_CONCURRENCY = int(os.getenv("BATCH_GROUNDING_CONCURRENCY", "4"))  # Requests grounding at once
+BATCH_LANES = int(os.getenv("BATCH_LANES", "0"))  # Concurrent generations per batch (0: every LLM worker)
+
+class ChatBatchRequest(BaseModel):
+    requests: list[ChatRequest] = Field(..., min_length=1, max_length=BATCH_MAX_REQUESTS)
+
+def common_prefix_length(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+class PromptPool:
+    """Batch prompts ready for generation.
+
+    A lane claims a prompt before checking out a model, then takes the one
+    sharing the longest token prefix with what that model already holds, so
+    llama-cpp re-evaluates as little as possible.
+    """
+
+    def __init__(self):
+        self.items = []  # (n, plan, tokens)
+        self.claimed = 0
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def put(self, n, plan):
+        try:
+            tokens = llm.tokenize(plan.prompt.encode("utf-8")) if llm else []
+        except Exception:
+            tokens = []
+        with self.cond:
+            self.items.append((n, plan, tokens))
+            self.cond.notify()
+
+    def close(self, drop=False):
+        with self.cond:
+            self.closed = True
+            if drop:
+                self.items.clear()
+            self.cond.notify_all()
+
+    def claim(self) -> bool:
+        """Block until a prompt no other lane has claimed is queued and claim it; False once closed and drained"""
+        with self.cond:
+            while len(self.items) <= self.claimed and not self.closed:
+                self.cond.wait()
+            if len(self.items) <= self.claimed:
+                return False
+            self.claimed += 1
+            return True
+
+    def unclaim(self):
+        """Give a claim back without taking a prompt"""
+        with self.cond:
+            self.claimed = max(0, self.claimed - 1)
+            self.cond.notify()
+
+    def take_best(self, model):
+        """Take a claimed prompt; None only if the pool was dropped"""
+        with self.cond:
+            if not self.items:
+                return None
+            self.claimed = max(0, self.claimed - 1)
+            cached = list(model.input_ids[:model.n_tokens])
+            best = max(range(len(self.items)), key=lambda i: common_prefix_length(cached, self.items[i][2]))
+            n, plan, _ = self.items.pop(best)
+            return n, plan
+
+def admit_batch_lanes() -> list:
+    """One ticket per generation lane; raises SchedulerSaturated only if none can be admitted"""
+    if not llm_scheduler:
+        raise RuntimeError("AI model not available")
+    tickets = []
+    for _ in range(max(1, BATCH_LANES or llm_scheduler.workers)):
+        try:
+            tickets.append(llm_scheduler.admit())
+        except SchedulerSaturated:
+            if not tickets:
+                raise
+            break
+    return tickets
+
+def iter_chat_batch(reqs: list, tickets: list = None):
+    """Answer many ChatRequests, yielding (index, result) as each one finishes.
+
+    Identical requests are answered once, key terms for the whole batch come
+    from one nlp.pipe pass, upstream fetches are shared across requests and
+    generation runs on one lane per ticket, overlapping with grounding.
+    """
+    tickets = tickets or admit_batch_lanes()
+    groups = {}
+    for i, req in enumerate(reqs):
+        key = (req.message.strip(), json.dumps(req.history or [], sort_keys=True), req.session_id)
+        groups.setdefault(key, []).append(i)
+    unique = [reqs[indices[0]] for indices in groups.values()]
+    index_groups = list(groups.values())
+
+    done = queue.Queue()
+    prompts = PromptPool()
+    fetches = SharedFetches()
+    analyses = QueryAnalysis.batch([req.message.strip() for req in unique])
+
+    def prepare(n):
+        trace = start_trace()
+        try:
+            plan = prepare_chat(unique[n], analyses[n], fetches, llm_scheduler.tier.max_prompt_tokens)
+        except Exception as e:
+            logger.exception("Batch request failed")
+            done.put((n, "error", {"error": "Clinical processing failed", "detail": str(e)}))
+            return
+        if plan.result is not None:
+            plan.remember(plan.result["reply"])
+            done.put((n, plan_outcome(plan), plan.result))
+        else:
+            plan.trace = trace
+            prompts.put(n, plan)
+
+    def lane(ticket):
+        while prompts.claim():
+            item = None
+            try:
+                with ticket.model() as model:
+                    item = prompts.take_best(model)
+                    if item is None:
+                        continue  # Batch abandoned
+                    raw = "".join(generate_tokens(model, item[1].prompt, item[1].trace))
+            except SchedulerSaturated:
+                prompts.unclaim()
+                continue  # Interactive requests hold every worker; wait for the next one
+            except Exception as e:
+                logger.exception("Batch generation failed")
+                if item:
+                    done.put((item[0], "error", {"error": "Clinical processing failed", "detail": str(e)}))
+                else:
+                    prompts.unclaim()
+                continue
+            n, plan = item
+            observe_stage("queue_wait", ticket.queue_wait, plan.trace)
+            reply = format_clinical_reply(raw.strip())
+            plan.store(reply, raw)
+            done.put((n, "generated", {"reply": reply, "cache": "miss", "timings": dict(ticket.timings(), **plan.trace)}))
+
+    preparers = ThreadPoolExecutor(max_workers=BATCH_GROUNDING_CONCURRENCY, thread_name_prefix="batch")
+    lanes = [threading.Thread(target=lane, args=(t,), name="batch-lane", daemon=True) for t in tickets]
+    for thread in lanes:
+        thread.start()
+    prepared = [preparers.submit(prepare, n) for n in range(len(unique))]
+
+    def close_when_prepared():
+        wait(prepared)
+        prompts.close()
+
+    threading.Thread(target=close_when_prepared, daemon=True).start()
+
+    start = time.monotonic()
+    finished = False
+    try:
+        for _ in range(len(unique)):
+            n, outcome, result = done.get()
+            REQUESTS.inc(len(index_groups[n]), endpoint="chat_batch", outcome=outcome)
+            for index in index_groups[n]:
+                yield index, result
+        finished = True
+        logger.info(
+            f"Batch of {len(reqs)} ({len(unique)} unique) done in {time.monotonic() - start:.2f}s, "
+            f"{fetches.shared} upstream fetches shared"
+        )
+    finally:
+        preparers.shutdown(wait=False, cancel_futures=not finished)
+        if not finished:  # Consumer went away: drop the remaining work
+            prompts.close(drop=True)
+        for thread in lanes:
+            thread.join()
+        for ticket in tickets:
+            ticket.release()
+
+# Batch endpoint: results stream back as NDJSON lines, in completion order
+@app.post("/chat/batch")
+def chat_batch(batch: ChatBatchRequest):
+    if still_starting():
+        REQUESTS.inc(len(batch.requests), endpoint="chat_batch", outcome="starting")
+        return starting_response()
+    if not llm_scheduler:
+        return {"error": "AI model not available", "detail": "LLM failed to initialize"}
+
+    try:
+        tickets = admit_batch_lanes()
+    except SchedulerSaturated as e:
+        REQUESTS.inc(len(batch.requests), endpoint="chat_batch", outcome="busy")
+        logger.warning(str(e))
+        return busy_response(e)
+
+    def lines():
+        results = iter_chat_batch(batch.requests, tickets)
+        try:
+            for index, result in results:
+                yield json.dumps(dict(result, index=index)) + "\n"
+        finally:
+            results.close()  # Stops the lanes before TicketedBody releases their tickets
+
+    return StreamingResponse(TicketedBody(lines(), tickets), media_type="application/x-ndjson")
+
+def render_stats_gauges(prefix, stats, labels=()):
+    """Expose a snapshot_stats() dict as gauges"""
+    return render_labelled_gauges(prefix, [(labels, stats)])
+
+def render_labelled_gauges(prefix, rows):
+    """Expose several (labels, snapshot_stats()) rows as gauges, one family per key"""
+    families = {}
+    for labels, stats in rows:
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                families.setdefault(key, []).append(f"{prefix}_{key}{format_labels(labels)} {value}")
+    lines = []
+    for key, samples in sorted(families.items()):
+        lines += [f"# TYPE {prefix}_{key} gauge"] + samples
+    return lines
+
+# Prometheus scrape endpoint
+@app.get("/metrics")
+def metrics():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += render_stats_gauges("sawa_knowledge_cache", knowledge_cache.snapshot_stats())
+    lines += render_stats_gauges("sawa_response_cache", response_cache.snapshot_stats())
+    lines += render_stats_gauges("sawa_redis_writer", redis_writer.snapshot_stats())
+    lines += render_stats_gauges("sawa_session_states", session_states.snapshot_stats())
+    lines += render_labelled_gauges(
+        "sawa_source", [((("source", name),), health.snapshot_stats()) for name, health in source_health.items()]
+    )
+    lines += render_labelled_gauges(
+        "sawa_scheduler", [((("tier", tier.name),), tier.scheduler.snapshot_stats()) for tier in llm_tiers]
+    )
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
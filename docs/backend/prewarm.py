@@ -0,0 +1,40 @@
+"""Pre-warm the knowledge cache and write the snapshot the server loads at boot.
+
+Fetches every MEDICAL_KNOWLEDGE_HUB source and the dictionary for the hot
+terms (MEDICAL_ACRONYMS, MEDICAL_SHORTHAND, MINIMAL_RESPONSES) plus any extra
+terms, in parallel, and saves the results to CACHE_SNAPSHOT_PATH.
+
+Run from docs/backend:
+    python prewarm.py
+    python prewarm.py --terms-file terms.txt --term sepsis --out knowledge_cache.snapshot
+"""
+import argparse
+
+import main
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Pre-warm the knowledge cache into a snapshot file")
+    parser.add_argument("--out", default=main.CACHE_SNAPSHOT_PATH)
+    parser.add_argument("--term", action="append", default=[], help="Extra term (repeatable)")
+    parser.add_argument("--terms-file", help="File with one term per line")
+    parser.add_argument("--no-hot-terms", action="store_true", help="Only fetch the terms given on the command line")
+    parser.add_argument("--timeout", type=float, default=main.PREWARM_TIMEOUT)
+    args = parser.parse_args()
+
+    terms = [] if args.no_hot_terms else main.hot_terms()
+    terms += [t.lower() for t in args.term]
+    if args.terms_file:
+        with open(args.terms_file) as f:
+            terms += [line.strip().lower() for line in f if line.strip() and not line.startswith("#")]
+    terms = list(dict.fromkeys(terms))
+    if not terms:
+        parser.error("no terms to fetch")
+
+    stats = main.prewarm_cache(terms, timeout=args.timeout)
+    count = main.save_cache_snapshot(args.out)
+    print(f"{stats['terms']} terms, {stats['found']}/{stats['fetches']} fetches with content, {count} entries written to {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()
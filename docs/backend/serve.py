@@ -0,0 +1,57 @@
+"""Multi-process server: N uvicorn workers sharing one memory-mapped GGUF.
+
+Each worker process imports main.py and maps the model with use_mmap, so the
+weights are held once in the page cache instead of once per process. Cores are
+split across workers through LLM_THREADS (default: cpu_count / workers).
+
+Run from docs/backend:
+    python serve.py --workers 4 --port 8000
+    python serve.py --workers 2 --threads-per-worker 3 --warm-page-cache
+"""
+import argparse
+import os
+
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATH = "models/tinyllama-1.1b-chat-v1.0.Q8_0.gguf"
+
+
+def warm_page_cache(model_path, chunk_size=16 * 1024 * 1024):
+    """Read the GGUF once in the parent so every worker maps already-resident pages"""
+    with open(model_path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while f.read(chunk_size):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the backend with several worker processes")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="llama.cpp threads per process (default: cpu_count / workers)")
+    parser.add_argument("--warm-page-cache", action="store_true",
+                        help="Read the model file into the page cache before forking workers")
+    args = parser.parse_args()
+
+    # Workers inherit the environment, so main.py picks these up at import
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    os.environ["MODEL_USE_MMAP"] = "1"
+    if args.threads_per_worker:
+        os.environ["LLM_THREADS"] = str(args.threads_per_worker)
+
+    model_path = os.getenv("MODEL_PATH", DEFAULT_MODEL_PATH)
+    if not os.path.isabs(model_path):
+        model_path = os.path.join(BACKEND_DIR, model_path)
+        os.environ["MODEL_PATH"] = model_path
+    if args.warm_page_cache and os.path.exists(model_path):
+        warm_page_cache(model_path)
+
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, app_dir=BACKEND_DIR)
+
+
+if __name__ == "__main__":
+    main()
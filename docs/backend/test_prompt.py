@@ -1,16 +1,170 @@
+import gc
+import time
+
+import pytest
+from pydantic import ValidationError
+
 import main
+from bench_fakes import StubLlama
 
 # Create long history of 10 exchanges
 history = [
     {"user": f"question {i}", "ai": "answer" * 50} for i in range(10)
 ]
 user_input = "Tell me about management of chronic atrial fibrillation in detail"
+sources = [
+    {"desc": "Medical Knowledge Hub", "content": "Rate control with beta blockers in atrial fibrillation " * 4, "url": ""},
+    {"desc": "MedlinePlus", "content": "Atrial fibrillation (AFib) is the most common type of arrhythmia " * 4, "url": "https://medlineplus.gov/atrialfibrillation.html"},
+    {"desc": "Dictionary", "content": "fibrillation: a rapid, irregular contraction of muscle fibers", "url": None},
+]
+
+
+def legacy_prepare_prompt_and_trim(history, user_input, sources):
+    """The rebuild-and-retokenize loop the budgeter replaced, kept for comparison"""
+    sources = list(sources)
+    prompt = main.build_prompt(history, user_input, sources)
+    token_count = main.safe_token_count(prompt)
+    while token_count > main.MAX_PROMPT_TOKENS:
+        if history:
+            history = history[:-1]
+        elif sources and len(sources) > 1:
+            non_clinical = [s for s in sources if s['desc'] in ["Dictionary", "Wikipedia"]]
+            if non_clinical:
+                sources.remove(non_clinical[0])
+            else:
+                sources.pop()
+        elif len(user_input) > 50:
+            user_input = user_input[:40] + "..."
+        else:
+            prompt = prompt[:500] + "..."
+            break
+        prompt = main.build_prompt(history, user_input, sources)
+        token_count = main.safe_token_count(prompt)
+    return prompt
+
+
+def test_prompt_fits_context_window():
+    prompt = main.prepare_prompt_and_trim(history, user_input, sources)
+    assert main.safe_token_count(prompt) <= main.MAX_PROMPT_TOKENS, "Prompt exceeds context window"
+    assert prompt.startswith(main.SYSTEM_PROMPT)
+    assert prompt.endswith("\nAI:")
+
+
+def test_short_prompt_is_untouched():
+    short_sources = sources[:1]
+    prompt = main.prepare_prompt_and_trim(history[-1:], user_input, short_sources)
+    assert prompt == main.build_prompt(history[-1:], user_input, short_sources)
+
+
+def test_history_and_non_clinical_sources_trimmed_first(monkeypatch):
+    costs = {main.SYSTEM_PROMPT: 100}
+    monkeypatch.setattr(main, "segment_token_count", lambda text: costs.get(text, 10))
+    monkeypatch.setattr(main, "MAX_PROMPT_TOKENS", 135)
+    prompt = main.prepare_prompt_and_trim(history[-1:], user_input, sources)
+    assert "question 9" not in prompt
+    assert "fibrillation: a rapid" not in prompt
+    assert "Rate control" in prompt and "most common type" in prompt
+
+
+def test_session_prompt_extends_previous_turn():
+    turn_sources = [s["content"] for s in sources[:1]]
+    first = main.build_session_prompt([], "question one", sources[:1])
+    turn = {"user": "question one", "ai": " answer one", "sources": turn_sources}
+    second = main.build_session_prompt([turn], user_input, sources[1:2])
+    assert second.startswith(first + " answer one\n")
+
+
+def stub_tier(monkeypatch):
+    """One loaded tier of stub models, offline, with startup finished"""
+    tier = main.ModelTier("test", "stub.gguf")
+    tier.scheduler = main.InferenceScheduler([StubLlama()], tier=tier)
+    monkeypatch.setattr(main, "llm_tiers", [tier])
+    monkeypatch.setattr(main, "llm_scheduler", tier.scheduler)
+    monkeypatch.setattr(main, "OFFLINE_MODE", True)
+    for name in main.REQUIRED_COMPONENTS:
+        monkeypatch.setitem(main.component_status[name], "state", "ready")
+    return tier.scheduler
+
+
+def test_dropped_stream_frees_its_slot(monkeypatch):
+    scheduler = stub_tier(monkeypatch)
+    response = main.chat_stream(main.ChatRequest(message="How is lithium toxicity managed?"))
+    assert scheduler.in_flight == 1
+    del response  # Client gone before the first chunk: the body is never iterated
+    gc.collect()
+    assert scheduler.in_flight == 0
+
+
+
+def test_dropped_batch_frees_its_lanes(monkeypatch):
+    scheduler = stub_tier(monkeypatch)
+    batch = main.ChatBatchRequest(requests=[{"message": "How is lithium toxicity managed?"}] * 2)
+    response = main.chat_batch(batch)
+    assert scheduler.in_flight == 1
+    del response
+    gc.collect()
+    assert scheduler.in_flight == 0
+
+
+def test_prompt_pool_claims_each_prompt_once():
+    prompts = main.PromptPool()
+    prompts.put(0, main.ChatPlan(prompt="question"))
+    prompts.close()
+    assert prompts.claim()
+    # A second lane must not check out a model (and record an empty generation) for it
+    assert not prompts.claim()
+
+
+def test_session_follow_up_extends_saved_state(monkeypatch):
+    scheduler = stub_tier(monkeypatch)
+    monkeypatch.setattr(main, "session_states", main.SessionStateStore())
+    monkeypatch.setattr(StubLlama, "tokens_per_sec", 1e6)
+    session = main.ChatSession(main.ChatSession.start())
+    ticket = scheduler.admit()
+    state_key = session.state_key(ticket.tier)
+    first = main.build_session_prompt(session.turns, "question one", sources[:1])
+    raw = main.generate_reply(ticket, first, state_key=state_key)
+    ticket.release()
+    session.remember("question one", raw, [sources[0]["content"]])
+    saved, _ = main.session_states.get(state_key)
+    second = main.build_session_prompt(session.turns, "question two", sources[1:2])
+    # The saved state is the whole first prompt plus every generated token
+    assert saved == StubLlama().tokenize(first + raw)
+    assert StubLlama().tokenize(second)[:len(saved)] == saved
+
+
+def test_unissued_session_id_is_rejected(monkeypatch):
+    stub_tier(monkeypatch)
+    with pytest.raises(ValidationError):
+        main.ChatRequest(message="follow-up", session_id="test")
+    response = main.run_chat(main.ChatRequest(message="follow-up", session_id="0" * 32))
+    assert response.status_code == 404
+    assert main.ChatSession(main.ChatSession.start()).turns == []
+
+
+if __name__ == "__main__":
+    runs = 200
+    full_budget = main.MAX_PROMPT_TOKENS
+    # "tight" forces the trimmer through several drops, where the legacy loop re-tokenizes each time
+    for budget_name, budget in [("full", full_budget), ("tight", 120)]:
+        main.MAX_PROMPT_TOKENS = budget
+        for name, func in [("legacy loop", legacy_prepare_prompt_and_trim), ("segment budget", main.prepare_prompt_and_trim)]:
+            main.segment_token_count.cache_clear()
+            start = time.perf_counter()
+            for _ in range(runs):
+                prompt = func(history, user_input, sources)
+            elapsed = (time.perf_counter() - start) / runs * 1000
+            print(f"{budget_name:<6} {name:<15} {elapsed:8.3f} ms/call  tokens={main.safe_token_count(prompt)}")
+    main.MAX_PROMPT_TOKENS = full_budget
 
-prompt = main.prepare_prompt(history, user_input)
+    print("Prompt:\n", prompt[:200], "...")
+    test_prompt_fits_context_window()
+    test_short_prompt_is_untouched()
+    print("Test passed")
 
-num_tokens = len(main.llm.tokenize(prompt.encode()))
-print("Tokens:", num_tokens)
-print("Prompt:\n", prompt[:200], "...")
 
-assert num_tokens <= main.MAX_PROMPT_TOKENS, "Prompt exceeds context window"
-print("Test passed")
+def test_off_topic_local_hit_is_not_a_source(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "local_knowledge", main.local_index.load_or_build(str(tmp_path / "knowledge.idx")))
+    found, _ = main.search_local_knowledge("treatment of depression")
+    # Seasonal Affective Disorder mentions depression in its body only
+    assert found and not any(s["content"].startswith("Seasonal Affective Disorder") for s in found)